@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+# Offline benchmark for doc_scraper.py. Generates a synthetic github
+# organisation, serves it from a local stand-in for the parts of the github api
+# that the scraper uses, with local bare git repositories for the wikis, and
+# then runs the scraper against it, measuring the time taken, the number of
+# requests made and the peak memory used.
+#
+# The scraper is run twice in the same workspace: a cold run with empty caches,
+# and a warm run where nothing has changed, which shows how well the caches and
+# the scrape manifest work.
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import base64
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+SCRAPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doc_scraper.py")
+
+def git_sha(data, obj_type="blob"):
+    """The sha git would give an object with the given contents
+    """
+    return hashlib.sha1("{0} {1}\0".format(obj_type, len(data)) + data).hexdigest()
+
+class SyntheticOrg(object):
+    """A randomly generated organisation. Each repository has a readme at the
+    top level, a number of subpackages with their own readme and package.xml,
+    and some other files to make the tree a realistic size. Some repositories
+    also have a wiki.
+
+    """
+    def __init__(self, name, num_repos, readmes=(0, 10), files=(20, 200), wiki_fraction=0.2, seed=0):
+        self.name = name
+        self.repos = {}
+        rand = random.Random(seed)
+        for i in range(num_repos):
+            repo_name = "repo_{0:04d}".format(i)
+            blobs = {"README.md": self.markdown(rand, repo_name)}
+            for j in range(rand.randint(*readmes)):
+                subpkg = "{0}_pkg_{1}".format(repo_name, j)
+                blobs["{0}/README.md".format(subpkg)] = self.markdown(rand, subpkg)
+                blobs["{0}/package.xml".format(subpkg)] = self.package_xml(subpkg)
+            for j in range(rand.randint(*files)):
+                blobs["src/file_{0}.cpp".format(j)] = "// source file {0}\n".format(j) * rand.randint(1, 50)
+
+            wiki = None
+            if rand.random() < wiki_fraction:
+                wiki = {"Home.md": self.markdown(rand, repo_name + " wiki")}
+                for j in range(rand.randint(1, 10)):
+                    wiki["Page-{0}.md".format(j)] = self.markdown(rand, "page {0}".format(j))
+
+            self.repos[repo_name] = {"blobs": blobs,
+                                     "shas": {path: git_sha(data) for path, data in blobs.items()},
+                                     "commit": hashlib.sha1(repo_name + str(seed)).hexdigest(),
+                                     "wiki": wiki}
+
+    def markdown(self, rand, title):
+        sections = []
+        for i in range(rand.randint(1, 8)):
+            sections.append("## Section {0}\n\n{1}\n\n```\nrosrun {2} node\n```\n".format(
+                i, " ".join("word{0}".format(rand.randint(0, 1000)) for _ in range(rand.randint(20, 200))), title))
+        return "# {0}\n\n{1}".format(title, "\n".join(sections))
+
+    def package_xml(self, name):
+        return "<package>\n  <name>{0}</name>\n  <description>The {0} package</description>\n</package>\n".format(name)
+
+    def write_wikis(self, git_dir):
+        """Create bare repositories for the wikis at git_dir/org/repo.wiki.git
+        """
+        env = dict(os.environ, GIT_AUTHOR_NAME="benchmark", GIT_AUTHOR_EMAIL="benchmark@localhost",
+                   GIT_COMMITTER_NAME="benchmark", GIT_COMMITTER_EMAIL="benchmark@localhost")
+        FNULL = open(os.devnull, 'w')
+        for repo_name, repo in self.repos.items():
+            if not repo["wiki"]:
+                continue
+            work_dir = tempfile.mkdtemp()
+            for page, text in repo["wiki"].items():
+                with open(os.path.join(work_dir, page), 'w') as f:
+                    f.write(text)
+            subprocess.check_call(["git", "init", "--quiet", work_dir], stdout=FNULL)
+            subprocess.check_call(["git", "-C", work_dir, "add", "."], env=env)
+            subprocess.check_call(["git", "-C", work_dir, "commit", "--quiet", "-m", "wiki"], env=env)
+            subprocess.check_call(["git", "clone", "--quiet", "--bare", work_dir,
+                                   os.path.join(git_dir, self.name, repo_name + ".wiki.git")])
+            shutil.rmtree(work_dir)
+
+class FakeGithubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the github api endpoints used by the scraper from a SyntheticOrg.
+    Responses have ETags and rate limit headers like the real api.
+
+    """
+    protocol_version = "HTTP/1.1"
+
+    routes = [("org_repos", re.compile(r"^/orgs/([^/]+)/repos$")),
+              ("repo", re.compile(r"^/repos/([^/]+)/([^/]+)$")),
+              ("commits", re.compile(r"^/repos/([^/]+)/([^/]+)/commits$")),
+              ("tree", re.compile(r"^/repos/([^/]+)/([^/]+)/git/trees/([0-9a-f]+)$")),
+              ("blob", re.compile(r"^/repos/([^/]+)/([^/]+)/git/blobs/([0-9a-f]+)$"))]
+
+    def log_message(self, *args):
+        pass # keep the benchmark output readable
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        for route, route_re in self.routes:
+            match = route_re.match(url.path)
+            if match:
+                self.server.count(route)
+                body, headers = getattr(self, "get_" + route)(query, *match.groups())
+                if body is None:
+                    return self.send(404, json.dumps({"message": "Not Found"}))
+                return self.send(200, json.dumps(body), headers)
+
+        self.server.count("not_found")
+        self.send(404, json.dumps({"message": "Not Found"}))
+
+    def send(self, status, body, headers=None):
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.server.count("not_modified")
+            status, body = 304, ""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Limit", "1000000")
+        self.send_header("X-RateLimit-Remaining", "1000000")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def base_url(self):
+        return "http://{0}:{1}".format(*self.server.server_address)
+
+    def get_org_repos(self, query, org_name):
+        org = self.server.org
+        names = sorted(org.repos.keys())
+        per_page = int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        last_page = max(1, (len(names) + per_page - 1) // per_page)
+        repos = [self.repo_data(name) for name in names[(page - 1) * per_page:page * per_page]]
+
+        links = []
+        page_url = "{0}/orgs/{1}/repos?type=all&per_page={2}&page={{0}}".format(self.base_url(), org_name, per_page)
+        if page < last_page:
+            links.append('<{0}>; rel="next"'.format(page_url.format(page + 1)))
+            links.append('<{0}>; rel="last"'.format(page_url.format(last_page)))
+        return repos, {"Link": ", ".join(links)} if links else {}
+
+    def repo_data(self, name):
+        return {"name": name,
+                "default_branch": "master",
+                "clone_url": "{0}/{1}/{2}.git".format(self.server.git_url, self.server.org.name, name)}
+
+    def get_repo(self, query, org_name, repo_name):
+        if repo_name not in self.server.org.repos:
+            return None, None
+        return self.repo_data(repo_name), {}
+
+    def get_commits(self, query, org_name, repo_name):
+        if repo_name not in self.server.org.repos:
+            return None, None
+        return [{"sha": self.server.org.repos[repo_name]["commit"]}], {}
+
+    def get_tree(self, query, org_name, repo_name, sha):
+        repo = self.server.org.repos.get(repo_name)
+        if not repo:
+            return None, None
+        tree = []
+        for path, blob_sha in sorted(repo["shas"].items()):
+            tree.append({"path": path, "type": "blob", "sha": blob_sha, "mode": "100644",
+                         "url": "{0}/repos/{1}/{2}/git/blobs/{3}".format(self.base_url(), org_name, repo_name, blob_sha)})
+        return {"sha": sha, "tree": tree, "truncated": False}, {}
+
+    def get_blob(self, query, org_name, repo_name, sha):
+        repo = self.server.org.repos.get(repo_name)
+        blobs = {blob_sha: path for path, blob_sha in repo["shas"].items()} if repo else {}
+        if sha not in blobs:
+            return None, None
+        return {"sha": sha, "encoding": "base64", "content": base64.b64encode(repo["blobs"][blobs[sha]])}, {}
+
+class FakeGithubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, org, git_url):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), FakeGithubHandler)
+        self.org = org
+        self.git_url = git_url
+        self.lock = threading.Lock()
+        self.requests = {}
+
+    def count(self, route):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def take_counts(self):
+        with self.lock:
+            counts, self.requests = self.requests, {}
+        return counts
+
+def make_workspace(path):
+    """Create a minimal copy of the strands_documentation layout for the scraper
+    to run in
+    """
+    os.makedirs(os.path.join(path, "conf"))
+    os.makedirs(os.path.join(path, "docs"))
+    with open(os.path.join(path, "conf", "conf.yaml"), 'w') as f:
+        f.write("ignore_repos: []\nrst_index_config: []\n")
+    with open(os.path.join(path, "docs", "index.rst"), 'w') as f:
+        f.write("Benchmark\n=========\n\n.. toctree::\n")
+    # Pretend to have a token so the scraper doesn't ask for one
+    with open(os.path.join(path, ".strands_doc_oauth.tok"), 'w') as f:
+        f.write("benchmark")
+
+def run_scraper(server, workspace, git_url, scraper_args):
+    """Run the scraper against the server, returning the measurements
+    """
+    api_url = "http://{0}:{1}".format(*server.server_address)
+    report_path = os.path.join(workspace, "profile.json")
+    cmd = [sys.executable, SCRAPER, "--org", server.org.name, "--api-url", api_url, "--git-url", git_url,
+           "--profile", report_path] + scraper_args
+    env = dict(os.environ, HOME=workspace)
+
+    with open(os.path.join(workspace, "scraper.log"), 'a') as log:
+        start = time.time()
+        proc = subprocess.Popen(cmd, cwd=workspace, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of just this child
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.time() - start
+        # Decode the status the same way as Popen.returncode, which is negative
+        # if the scraper was killed by a signal
+        if os.WIFSIGNALED(status):
+            status = -os.WTERMSIG(status)
+        else:
+            status = os.WEXITSTATUS(status)
+        proc.returncode = status
+
+    profile = {}
+    if os.path.isfile(report_path):
+        with open(report_path, 'r') as f:
+            profile = json.load(f)["totals"]
+
+    return {"exit_status": status,
+            "wall_time": elapsed,
+            # ru_maxrss is in kilobytes on linux
+            "peak_memory_mb": usage.ru_maxrss / 1024.0,
+            "server_requests": server.take_counts(),
+            "scraper": profile}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark doc_scraper.py against a local fake github api with a synthetic organisation. Needs git and pandoc.")
+    parser.add_argument("--repos", type=int, nargs="+", default=[10, 100], help="Sizes of organisation to benchmark, in number of repositories. Default is 10 and 100.")
+    parser.add_argument("--readmes", type=int, nargs=2, default=[0, 10], metavar=("MIN", "MAX"), help="Range of the number of subpackage readmes in each repository")
+    parser.add_argument("--files", type=int, nargs=2, default=[20, 200], metavar=("MIN", "MAX"), help="Range of the number of other files in each repository")
+    parser.add_argument("--wiki-fraction", type=float, default=0.2, help="Fraction of repositories which have a wiki")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for generating the organisations")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    parser.add_argument("--keep", action="store_true", help="Don't delete the workspaces when finished")
+    parser.add_argument("scraper_args", nargs=argparse.REMAINDER, help="Extra arguments to pass to the scraper, after --")
+    args = parser.parse_args()
+    scraper_args = [arg for arg in args.scraper_args if arg != "--"]
+
+    results = []
+    for num_repos in args.repos:
+        base_dir = tempfile.mkdtemp(prefix="strands_doc_benchmark_")
+        git_dir = os.path.join(base_dir, "git")
+        workspace = os.path.join(base_dir, "workspace")
+        git_url = "file://" + git_dir
+
+        print("Generating organisation with {0} repositories in {1}".format(num_repos, base_dir))
+        org = SyntheticOrg("benchmark-org", num_repos, readmes=args.readmes, files=args.files,
+                           wiki_fraction=args.wiki_fraction, seed=args.seed)
+        org.write_wikis(git_dir)
+        make_workspace(workspace)
+
+        server = FakeGithubServer(org, git_url)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        try:
+            result = {"repos": num_repos,
+                      "readmes": sum(sum(1 for path in repo["blobs"] if path.endswith(".md")) for repo in org.repos.values()),
+                      "wikis": sum(1 for repo in org.repos.values() if repo["wiki"])}
+            for run in ["cold", "warm"]:
+                print("{0} run...".format(run))
+                result[run] = run_scraper(server, workspace, git_url, scraper_args)
+                print("  {0:.2f}s, {1} requests, {2:.1f}MB peak memory, exit status {3}".format(
+                    result[run]["wall_time"], sum(result[run]["server_requests"].values()),
+                    result[run]["peak_memory_mb"], result[run]["exit_status"]))
+            results.append(result)
+        finally:
+            server.shutdown()
+            server.server_close()
+            if args.keep:
+                print("Workspace kept in {0}".format(base_dir))
+            else:
+                shutil.rmtree(base_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Builds the documentation with sphinx. The scraper records the docs files it
+# changes, creates and removes in a changes file, and if pages were added or
+# removed the TOC in index.rst is regenerated first. Sphinx is then run with
+# parallel workers in its usual incremental mode. Since the scraper only
+# touches files whose contents changed, sphinx only rebuilds those pages and the
+# pages which depend on them, like the sidebars linking to new or deleted
+# pages. The changes file is cleared once the build succeeds.
+#
+# This should be run from the top level directory of strands_documentation.
+
+import os
+import sys
+import yaml
+import argparse
+import subprocess
+import multiprocessing
+import doc_scraper
+import docs_index
+import output_files
+import instrumentation
+
+DOCS_DIR = "docs"
+SOURCE_SUFFIX = ".rst"
+
+def print_timings():
+    report = instrumentation.recorder.report()
+    for name, phase in sorted(report["totals"]["phases"].items(), key=lambda item: -item[1]["wall_time"]):
+        print("{0:>24}: {1:.2f}s".format(name, phase["wall_time"]))
+    print("{0:>24}: {1:.2f}s".format("total", report["wall_time"]))
+
+def toc_changed(changes):
+    """Whether pages were added or removed, in which case the TOC has to be
+    regenerated
+    """
+    return any(path.endswith(SOURCE_SUFFIX) for path in changes["created"] | changes["removed"])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the documentation with sphinx, regenerating the TOC first if doc_scraper.py added or removed pages. Only pages which changed since the last build, and the pages which depend on them, are rebuilt. This script should be run from the top level directory of strands_documentation.")
+    parser.add_argument("--changes", default="docs/_changed_outputs.json", help="The changes file written by doc_scraper.py. Default is docs/_changed_outputs.json.")
+    parser.add_argument("--conf", default="./conf/conf.yaml", help="Config file containing the rst_index_config used to regenerate the TOC. Default is strands_documentation/conf/conf.yaml.")
+    parser.add_argument("--build-dir", default="docs/_build/html", help="The sphinx output directory. Default is docs/_build/html.")
+    parser.add_argument("--builder", "-b", default="html", help="The sphinx builder to use. Default is html.")
+    parser.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count(), help="Number of sphinx worker processes. Default is the number of cores.")
+    parser.add_argument("--full", action="store_true", help="Rebuild all pages, whatever has changed.")
+    args = parser.parse_args()
+
+    with instrumentation.phase("load_changes"):
+        changes = output_files.load_changes(args.changes)
+    print("{0} changed, {1} created and {2} removed files recorded".format(
+        len(changes["changed"]), len(changes["created"]), len(changes["removed"])))
+
+    if toc_changed(changes):
+        print("Pages were added or removed, regenerating the TOC")
+        with instrumentation.phase("regenerate_toc"):
+            with open(args.conf, 'r') as f:
+                config = yaml.safe_load(f.read())
+            doc_scraper.write_rst_toc_to_index(config, docs_index.DocsIndex(DOCS_DIR))
+
+    # Without any filenames sphinx works out itself which pages are out of
+    # date, including changes made outside the scraper
+    cmd = ["sphinx-build", "-b", args.builder, "-j", str(args.jobs)]
+    if args.full:
+        print("Rebuilding all pages")
+        cmd.extend(["-a", "-E"])
+    cmd.extend([DOCS_DIR, args.build_dir])
+
+    with instrumentation.phase("sphinx_build"):
+        status = subprocess.call(cmd)
+
+    if status == 0:
+        # The TOC is up to date with everything recorded
+        if os.path.isfile(args.changes):
+            os.remove(args.changes)
+    else:
+        print("sphinx-build failed with status {0}, keeping the changes file".format(status))
+
+    print_timings()
+    sys.exit(status)
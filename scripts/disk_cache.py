@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# A simple size-bounded on-disk key-value store. Each entry is a single file in
+# the cache directory named by its key. The modification time of an entry is
+# updated whenever it is read, so that when the cache grows over its maximum
+# size the least recently used entries can be removed first. Entries are removed
+# until the cache is well under its maximum size, so that it doesn't have to be
+# scanned again on every write once it is full.
+
+import os
+import errno
+import hashlib
+import tempfile
+import threading
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Fraction of the maximum size the cache is trimmed down to when it gets too big
+LOW_WATER = 0.9
+
+def make_key(*parts):
+    """Make a cache key by hashing the given strings together
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        h.update(str(len(part)))
+        h.update(":")
+        h.update(part)
+
+    return h.hexdigest()
+
+class DiskCache(object):
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+
+        self.size = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        # Split entries over subdirectories so no single directory gets too big
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _entries(self):
+        """List (path, mtime, size) for all entries in the cache
+        """
+        entries = []
+        for subdir, dirs, files in os.walk(self.cache_dir):
+            for entry in files:
+                if entry.startswith("."):
+                    continue # partially written entry
+                path = os.path.join(subdir, entry)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue # removed by someone else in the meantime
+                entries.append((path, stat.st_mtime, stat.st_size))
+
+        return entries
+
+    def get(self, key):
+        """Get the data stored under the given key, or None if there is no such entry
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError as ex:
+            if ex.errno == errno.ENOENT:
+                return None
+            raise
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        """Store data under the given key, replacing any existing entry. The entry
+        is written to a temporary file first so that readers never see a partial
+        entry.
+
+        """
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            os.rename(tmp_path, path)
+            self.size += len(data) - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is down to
+        LOW_WATER of its maximum size. Should be called with the lock held.
+
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.size = sum(size for _, _, size in entries)
+        target = self.max_bytes * LOW_WATER
+        for path, mtime, size in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
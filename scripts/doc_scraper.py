@@ -4,6 +4,14 @@
 # puts them into directories by repository
 
 import requests
+import http_client
+import instrumentation
+import html_rewrite
+import git_mirror
+import docs_index
+import file_rules
+import pipeline
+import output_files
 import errno
 import getpass
 import os
@@ -12,17 +20,29 @@ import argparse
 import subprocess
 import shutil
 import base64
+import hashlib
+import tempfile
 import sys
 import fnmatch
 import yaml
-import pypandoc
+import pandoc_convert
 import urlparse
 import re
 import socket
 import functools
-import xml.etree.ElementTree as ET
+import atexit
+import cProfile
+import threading
+from multiprocessing.pool import ThreadPool
 
-os.environ.setdefault('PYPANDOC_PANDOC', '/usr/bin/pandoc')
+# Base url of the github api, and the base url from which repositories and wikis
+# are cloned. These can be changed to scrape from somewhere else, like a local
+# test server.
+GITHUB_API = "https://api.github.com"
+GIT_URL = "https://github.com"
+
+# Number of files to download at once from each repository
+FETCH_WORKERS = 4
 
 def path_to_arr(path):
     arr = []
@@ -32,7 +52,14 @@ def path_to_arr(path):
 
     return list(reversed(arr))
 
-def create_package_file(filetype="rst"):
+@instrumentation.timed("create_package_file")
+def create_package_file(filetype="rst", index=None):
+    """Write docs/packages.filetype, which lists the index of each package and
+    subpackage in the docs directory along with the description from its package
+    xml. index is a DocsIndex of the docs directory, which is built if not
+    given.
+
+    """
     if os.path.isfile("docs/package.{}".format(filetype)):
         done = False
         while not done:
@@ -44,60 +71,29 @@ def create_package_file(filetype="rst"):
                 print("Will not overwrite index. Exiting.")
                 sys.exit(0)
 
-    link_dict = {}
-    desc_dict = {}
-    # walk over the directory tree, and look for files with index, which we
-    # will link to
-    for subdir, dirs, files in os.walk("docs"):
-        # take all chars after the 5th in the joined path, to remove docs/ from the string
-        split = subdir.split('/')
-        if len(split) == 1: # skip the top level directory
-            continue
-        dirpath = os.path.join(*split[1:])
-
-        for file in files:
-            if fnmatch.fnmatch(file, "*.xml"):
-                fname, ext = os.path.splitext(file)
-                with open(os.path.join(subdir, file), 'r') as f:
-                    if fname == "package":
-                        dict_key = dirpath
-                    else:
-                        dict_key = os.path.join(dirpath, fname)
-                    desc_dict[dict_key] = get_package_xml_description(f.read())
-
-            if fnmatch.fnmatch(file, "index.{}".format(filetype)):
-                if not split[1] in link_dict:
-                    link_dict[split[1]] = []
-                # This will add links to the toplevel index and subpackage indexes
-                link_dict[split[1]].append((dirpath, "[{0}]({1})".format(dirpath, os.path.join(dirpath, file))))
+    if index is None:
+        index = docs_index.DocsIndex("docs")
+    link_dict = index.package_links(filetype)
 
     package_file = "docs/packages.{}".format(filetype)
-    with open(package_file, 'w') as f:
-        
-        f.write("# STRANDS Packages\n\nHere you can find all the documentation generated by the STRANDS project, aggregated from the github repositories.\n\n")
-        for pkg_name in sorted(link_dict.keys()):
-            link_list = link_dict[pkg_name]
-            # The first entry in the list is the main package link. Make sure to
-            # refer to the html page so things work (probably)
-            f.write("## {0}\n\n".format(link_list[0][1].replace(filetype, "html")))
-            # check base path and repeated subpackage path. e.g. in
-            # aaf_deployment, the readme for info_termianl is at
-            # aaf_deployment/info_terminal/readme.md, and package xml is at
-            # aaf_deployment/info_terminal/info_terminal/package.xml
-            if link_list[0][0] in desc_dict:
-                f.write("{0}\n\n".format(desc_dict[link_list[0][0]]))
-            elif os.path.join(link_list[0][0], os.path.basename(link_list[0][0])) in desc_dict:
-                f.write("{0}\n\n".format(desc_dict[os.path.join(link_list[0][0], os.path.basename(link_list[0][0]))]))
-
-            # Subsequent entries are subpackages
-            for link in link_list[1:]:
-                f.write("### {0}\n\n".format(link[1]))
-                if link[0] in desc_dict:
-                    f.write("{0}\n\n".format(desc_dict[link[0]]))
-                elif os.path.join(link[0], os.path.basename(link[0])) in desc_dict:
-                    f.write("{0}\n\n".format(desc_dict[os.path.join(link[0], os.path.basename(link[0]))]))
-
-    pypandoc.convert_file(package_file, filetype, format="md", outputfile=package_file)
+    # The markdown is put together in memory and converted, and the file is
+    # only written if the result is different
+    package_text = ["# STRANDS Packages\n\nHere you can find all the documentation generated by the STRANDS project, aggregated from the github repositories.\n\n"]
+    for pkg_name in sorted(link_dict.keys()):
+        link_list = link_dict[pkg_name]
+        # The first entry in the list is the main package link. Make sure to
+        # refer to the html page so things work (probably)
+        for i, (dirpath, index_file) in enumerate(link_list):
+            link = "[{0}]({1})".format(dirpath, index_file)
+            if i == 0:
+                package_text.append("## {0}\n\n".format(link.replace(filetype, "html")))
+            else: # Subsequent entries are subpackages
+                package_text.append("### {0}\n\n".format(link))
+            description = index.description(dirpath)
+            if description is not None:
+                package_text.append(u"{0}\n\n".format(description))
+
+    output_files.write(package_file, pandoc_convert.convert("".join(package_text), filetype, "md"))
 
 def get_oauth_header(private=False):
     # The first thing to do is get an OAuth token - we will use this in place of the
@@ -138,130 +134,274 @@ def get_oauth_header(private=False):
 
     return header
 
-def get_org_repo_dict(org, header=None):
+def get_json(url):
+    """Get the json data at the given url, raising an exception if the request
+    fails even after any retries
+    """
+    response = http_client.get(url)
+    response.raise_for_status()
+    return response.json()
+
+@instrumentation.timed("get_org_repo_dict")
+def get_org_repo_dict(org):
     """get a list of all the repositories in the given organisation
     """
 
-    print("https://api.github.com/orgs/{0}/repos?type=all".format(org))
-    repo_rq = requests.get("https://api.github.com/orgs/{0}/repos?type=all".format(org), headers=header)
-    repos = {repo_data["name"]: repo_data for repo_data in json.loads(repo_rq.text)}
-    # If there are more than 30 repos, there will be multiple pages
-    if "link" in repo_rq.headers:
-        # keep getting the data until we reach the final page - we can deduce this
-        # by there not being a link to the last page, because we are on it.
-        while "last" in repo_rq.headers["link"]:
-            print(repo_rq.headers["link"])
-            # Get the URL for the next page by splitting the links up
-            next_pg = repo_rq.headers["link"].split(',')[0].split(';')[0][1:-1]
-            repo_rq = requests.get(next_pg, headers=header)
-            repos.update({repo_data["name"]: repo_data for repo_data in json.loads(repo_rq.text)})
+    print("{0}/orgs/{1}/repos?type=all".format(GITHUB_API, org))
+    # The listing can run over several pages, which are fetched concurrently
+    repos = {repo_data["name"]: repo_data for repo_data in http_client.paginate("{0}/orgs/{1}/repos?type=all".format(GITHUB_API, org))}
 
     return repos
 
-def add_doc_footer(orig_file_url, file_path):
-    """Add a footer to a documentation file, pointing to the original file on the
-    web
+def doc_footer(orig_file_url):
+    """Get the footer for a documentation file, pointing to the original file on
+    the web
 
     """
-    with open(file_path, 'a') as f:
-        f.write("\n\nOriginal page: {}".format(orig_file_url))
+    return "\n\nOriginal page: {}".format(orig_file_url)
+
+def write_wiki_page(job):
+    """Convert a markdown wiki page and write it to the output file along with the
+    footer linking to the original page. The file is only written if its
+    contents changed. job is a (page file, output file, filetype, original url)
+    tuple.
+
+    """
+    page_file, output, filetype, orig_url = job
+    with open(page_file, 'r') as f:
+        text = pandoc_convert.convert(f.read(), filetype, "md")
+    output_files.write(output, text + doc_footer(orig_url))
+
+    return output
+
+# How git ls-remote reports a wiki which doesn't exist, for github and for local
+# repositories
+NO_WIKI_RE = re.compile(r"not found|does not appear to be a git repository|does not exist")
+
+def get_wiki_head(org_name, repo_name):
+    """Get the sha of the HEAD commit of the wiki for the given repository, or None
+    if the repository does not have a wiki. Raises CalledProcessError if it
+    couldn't be checked, e.g. because of a network problem, since then we don't
+    know whether there is a wiki.
 
-def get_wiki(org_name, repo_name, filetype="rst", ignore=None):
-    """Check if a wiki exists, and if it does, clone it to the docs/repo_name/wiki
     """
-    # to devnull so there's no output
-    FNULL = open(os.devnull, 'w')
     # We can check if a wiki exists by calling git ls-remote. If it returns an
     # OK, then there is a wiki
-    if subprocess.call(["git", "ls-remote", "https://github.com/{0}/{1}.wiki.git".format(org_name, repo_name)], stdout=FNULL, stderr=FNULL) == 0:
-        wiki_dir = "docs/{0}/wiki".format(repo_name)
-        # only clone if the wiki does not already exist
-        if os.path.isdir(wiki_dir):
-            shutil.rmtree(wiki_dir)
+    cmd = ["git", "ls-remote", "{0}/{1}/{2}.wiki.git".format(GIT_URL, org_name, repo_name), "HEAD"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    refs, err = proc.communicate()
+    if proc.returncode != 0:
+        if NO_WIKI_RE.search(err):
+            return None
+        raise subprocess.CalledProcessError(proc.returncode, cmd, err)
+
+    # output is "<sha>\tHEAD", or nothing if the wiki is empty
+    return refs.split()[0] if refs.strip() else None
+
+def update_wiki_clone(org_name, repo_name, clone_dir):
+    """Make sure there is an up to date shallow clone of the wiki of the given
+    repository in clone_dir. If there is already a clone there, only the latest
+    commit is fetched.
 
+    """
+    wiki_url = "{0}/{1}/{2}.wiki.git".format(GIT_URL, org_name, repo_name)
+    if os.path.isdir(os.path.join(clone_dir, ".git")):
+        print("Updating wiki clone in {}".format(clone_dir))
+        subprocess.check_call(["git", "-C", clone_dir, "fetch", "--quiet", "--depth", "1", "origin", "HEAD"])
+        subprocess.check_call(["git", "-C", clone_dir, "reset", "--quiet", "--hard", "FETCH_HEAD"])
+    else:
         print("Wiki exists. Cloning...")
-        subprocess.call(["git", "clone", "https://github.com/{0}/{1}.wiki.git".format(org_name, repo_name), wiki_dir])
-        # delete the .git directory cloned along with the wiki
-        shutil.rmtree(os.path.join(wiki_dir, ".git"))
-        # rename the Home file to index so it works properly with mkdocs
-        #os.rename(os.path.join(wiki_dir, "Home.md"), os.path.join(wiki_dir, "index.md"))
-
-        # Check the ignore list and remove any files which are in it.
-        if ignore:
-            for subdir, dirs, files in os.walk(wiki_dir):
-                # Should work for the most part... So many loops...
-                for wiki_file in files:
-                    for ignore_item in ignore:
-                        if ignore_item in os.path.join(subdir, wiki_file):
-                            print("Ignoring file {}".format(os.path.join(subdir, wiki_file)))
-                            os.remove(os.path.abspath(os.path.join(subdir, wiki_file)))
+        if os.path.isdir(clone_dir):
+            shutil.rmtree(clone_dir)
+        subprocess.check_call(["git", "clone", "--quiet", "--depth", "1", wiki_url, clone_dir])
+
+@instrumentation.timed("get_wiki")
+def get_wiki(org_name, repo_name, clone_dir, filetype="rst", ignore=None, previous_files=None):
+    """Update the clone of the wiki of the given repository in clone_dir, and copy
+    its pages to docs/repo_name/wiki, converting them to the given filetype.
+    This should only be called for repositories which have a wiki, which can be
+    checked with get_wiki_head.
+
+    Only pages which have changed since they were recorded in previous_files
+    are converted again, and the outputs of pages which have been removed from
+    the wiki are deleted.
+
+    Returns a dict with the path of each page in the wiki as the key, and its
+    blob sha and output file as the value.
+
+    """
+    update_wiki_clone(org_name, repo_name, clone_dir)
+    ignore = file_rules.IgnoreRules.compile(ignore)
+    wiki_dir = "docs/{0}/wiki".format(repo_name)
+    wiki_base_url = "https://github.com/{}/{}/wiki".format(org_name, repo_name)
+
+    # The blob sha of each page tells us whether it changed since the last run
+    pages = {}
+    tree = subprocess.check_output(["git", "-C", clone_dir, "ls-tree", "-r", "-z", "HEAD"])
+    for entry in tree.split("\0"):
+        if not entry:
+            continue
+        info, page = entry.split("\t", 1)
+        pages[page] = info.split()[2]
+
+    files = {}
+    jobs = []
+    for page in sorted(pages.keys()):
+        # Check the ignore list and skip any files which are in it.
+        if ignore and ignore.matches(os.path.join(wiki_dir, page)):
+            print("Ignoring file {}".format(os.path.join(wiki_dir, page)))
+            continue
 
         # The wiki is written in markdown, so need to convert it if the filetype
         # we're supposed to be using is different.
-        wiki_base_url = "https://github.com/{}/{}/wiki".format(org_name, repo_name)
-        if filetype != "md":
-            for subdir, dirs, files in os.walk(wiki_dir):
-                for wiki_file in files:
-                    if fnmatch.fnmatch(wiki_file, "*.md"):
-                        file_path = os.path.abspath(os.path.join(subdir, wiki_file))
-                        new_file_path = "{}.{}".format(os.path.splitext(file_path)[0], filetype)
-                        print("Converting wiki file {} to {}".format(file_path, filetype))
-                        pypandoc.convert_file(file_path, filetype, format="md", outputfile=new_file_path)
-                        # End of the wiki url is just the filename without an extension
-                        url_end = "" if wiki_file == "Home.md" else "/" + os.path.splitext(wiki_file)[0]
-                        add_doc_footer(wiki_base_url + url_end,
-                                       new_file_path)
-                        # remove the original markdown file
-                        os.remove(file_path)
-
-def get_repo_files(org_name, repo_name, match_ext=[], match_filename=[], match_full=[], ignore=[], header=""):
-    """Get files in the given repository which have extensions matching any in the
-    given match_ext list, or filenames (without extensions) which match any in
-    the given match_filename list. Full filenames (filename + extension) are
-    compared to entries in match_full.
-
-    A dictionary where the file path in the repository is the key, and the item
-    returned by the github api is the value will be returned.
+        convert = filetype != "md" and fnmatch.fnmatch(page, "*.md")
+        output = os.path.join(wiki_dir, "{}.{}".format(os.path.splitext(page)[0], filetype) if convert else page)
+        files[page] = {"sha": pages[page], "output": output}
+        if file_unchanged(previous_files, page, pages[page], output):
+            continue
+
+        if convert:
+            # End of the wiki url is just the filename without an extension
+            url_end = "" if page == "Home.md" else "/" + os.path.splitext(os.path.basename(page))[0]
+            jobs.append((os.path.join(clone_dir, page), output, filetype, wiki_base_url + url_end))
+        else:
+            output_files.copy(os.path.join(clone_dir, page), output)
+
+    # Pages are converted and written on the conversion worker pool
+    print("Converting {} changed wiki files to {}".format(len(jobs), filetype))
+    pandoc_convert.map(write_wiki_page, jobs)
+
+    # Remove the outputs of pages that no longer exist in the wiki
+    if previous_files:
+        current_outputs = set(item["output"] for item in files.values())
+        for page, item in previous_files.items():
+            if item["output"] not in current_outputs and output_files.remove(item["output"]):
+                print("Removed {}, which is no longer in the wiki".format(item["output"]))
+
+    return files
+
+class RepoSnapshot(object):
+    """The state of the default branch of a repository at the time of the scrape.
+    The latest commit sha and the recursive tree are each retrieved from github
+    only once, the first time they are needed, and can then be searched with
+    get_files as many times as required.
+
+    If repo_data as returned by get_org_repo_dict is given, the default branch
+    is taken from it rather than requesting the repository metadata again.
+
+    """
+    def __init__(self, org_name, repo_name, repo_data=None):
+        self.org_name = org_name
+        self.repo_name = repo_name
+        self._default_branch = repo_data["default_branch"] if repo_data else None
+        self._sha = None
+        self._tree = None
+
+    @property
+    def default_branch(self):
+        if self._default_branch is None:
+            repo_data = get_json("{0}/repos/{1}/{2}".format(GITHUB_API, self.org_name, self.repo_name))
+            self._default_branch = repo_data["default_branch"]
+        return self._default_branch
+
+    @property
+    def sha(self):
+        """The sha of the latest commit on the default branch
+        """
+        if self._sha is None:
+            commits = get_json("{0}/repos/{1}/{2}/commits?sha={3}&per_page=1".format(GITHUB_API, self.org_name, self.repo_name, self.default_branch))
+            self._sha = commits[0]["sha"]
+        return self._sha
+
+    @property
+    def tree(self):
+        """The list of items in the recursive tree of the latest commit
+        """
+        if self._tree is None:
+            with instrumentation.phase("get_repo_tree"):
+                self._tree = get_json("{0}/repos/{1}/{2}/git/trees/{3}?recursive=1".format(GITHUB_API, self.org_name, self.repo_name, self.sha))["tree"]
+        return self._tree
+
+    def read_file(self, item):
+        """Get the contents of a file from the tree
+        """
+        return base64.b64decode(get_json(item["url"])["content"])
+
+    @instrumentation.timed("get_repo_files")
+    def get_files(self, match_ext=[], match_filename=[], match_full=[], ignore=[]):
+        """Get files in the repository which have extensions matching any in the
+        given match_ext list, or filenames (without extensions) which match any
+        in the given match_filename list. Full filenames (filename + extension)
+        are compared to entries in match_full.
+
+        A dictionary where the file path in the repository is the key, and the
+        item returned by the github api is the value will be returned.
+
+        """
+        if not match_ext and not match_filename and not match_full:
+            return {}
+        # The main readme file in the repo is easily retrieved, but just do this using the tree instead
+        #readme_rq = http_client.get("https://api.github.com/repos/{0}/{1}/readme".format(org, repo_name))
+
+        # Look through the tree and try to find things which are likely to be readme-type files
+        print("Looking for files matching strings {0}".format(match_ext + match_filename + match_full))
+        # We gather readmes here so we can remap any links in them, which we need to
+        # do because we will change the filenames to make the documentation appear
+        # in a nicer way. Gather them in a dict which will group multiple readmes in
+        # the same subdirectory, which we want to handle differently.
+        matching = {}
+        matcher = file_rules.FileMatcher(match_ext, match_filename, match_full)
+        ignore = file_rules.IgnoreRules.compile(ignore)
+
+        for item in self.tree:
+            if not matcher.matches(item["path"]):
+                continue
+            # join repo name to the path so that we can exclude top level readme files more easily
+            if ignore and ignore.matches(os.path.join(self.repo_name, item["path"])):
+                print("ignoring file {}".format(item["path"]))
+            else:
+                matching[item["path"]] = item
+
+        return matching
+
+class MirrorSnapshot(RepoSnapshot):
+    """A RepoSnapshot which answers everything from a local bare mirror of the
+    repository in mirror_dir, rather than making requests to the github api. The
+    mirror is cloned or fetched when the snapshot is created.
 
     """
-    if not match_ext and not match_filename and not match_full:
-        return {}
-    # The main readme file in the repo is easily retrieved, but just do this using the tree instead
-    #readme_rq = requests.get("https://api.github.com/repos/{0}/{1}/readme".format(org, repo_name), headers=header)
-
-    # We also need to look at the whole repository to find the readmes for
-    # subdirectories, since there are many such cases. First, get the current
-    # commit sha on the default branch
-    sha_rq = requests.get("https://api.github.com/repos/{0}/{1}/commits".format(org_name, repo_name), headers=header)
-    latest_sha = json.loads(sha_rq.text)[0]["sha"]
-    # Use that sha to get the commit tree
-    tree_rq = requests.get("https://api.github.com/repos/{0}/{1}/git/trees/{2}?recursive=1".format(org_name, repo_name, latest_sha), headers=header)
-    repo_tree = json.loads(tree_rq.text)
-
-    # Look through the tree and try to find things which are likely to be readme-type files
-    print("Looking for files matching strings {0}".format(match_ext + match_filename + match_full))
-    # We gather readmes here so we can remap any links in them, which we need to
-    # do because we will change the filenames to make the documentation appear
-    # in a nicer way. Gather them in a dict which will group multiple readmes in
-    # the same subdirectory, which we want to handle differently.
-    matching = {}
-
-    for item in repo_tree["tree"]:
-        lower_fname, lower_ext = os.path.splitext(os.path.basename(item["path"].lower()))
-        fname_matches = map(lambda x: lower_fname == x.lower(), match_filename)
-        ext_matches = map(lambda x: lower_ext == x.lower(), match_ext)
-        full_matches = map(lambda x: lower_fname + lower_ext == x.lower(), match_full)
-        # join repo name to the path so that we can exclude top level readme files more easily
-        ignore_matches = map(lambda x: x in os.path.join(repo_name, item["path"]), ignore)
-        if (any(fname_matches) or any(ext_matches) or any(full_matches)) and not any(ignore_matches):
-            matching[item["path"]] = item
-        elif (any(fname_matches) or any(ext_matches) or any(full_matches)) and any(ignore_matches):
-            print("ignoring file {}".format(item["path"]))
-
-    return matching
+    def __init__(self, org_name, repo_name, mirror_dir, repo_data=None):
+        super(MirrorSnapshot, self).__init__(org_name, repo_name, repo_data)
+        if repo_data and "clone_url" in repo_data:
+            url = repo_data["clone_url"]
+        else:
+            url = "{0}/{1}/{2}.git".format(GIT_URL, org_name, repo_name)
+        self.mirror = git_mirror.GitMirror(mirror_dir, repo_name, url)
+        self.mirror.update()
+
+    @property
+    def default_branch(self):
+        if self._default_branch is None:
+            self._default_branch = self.mirror.default_branch()
+        return self._default_branch
+
+    @property
+    def sha(self):
+        if self._sha is None:
+            self._sha = self.mirror.rev_parse(self.default_branch)
+        return self._sha
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = self.mirror.ls_tree(self.sha)
+        return self._tree
+
+    def read_file(self, item):
+        return self.mirror.read_blob(item["sha"])
 
 def files_to_subpackages(file_dict):
-    """Converts a dict of path-item pairs received from get_repo_files to a dict
+    """Converts a dict of path-item pairs received from RepoSnapshot.get_files to a dict
     where files that are in the same subpackage can be found in a list under the
     key with the subpackage name.
 
@@ -280,21 +420,73 @@ def files_to_subpackages(file_dict):
 
     return new_dict
 
-def get_package_xml_description(xml):
-    root = ET.fromstring(xml)
-    return root.findall("description")[0].text
+IMAGE_DOWNLOAD_WORKERS = 8
+IMAGE_STORE = "docs/images/store"
+
+def download_image(image_link):
+    """Download an image into the image store, where it is saved under the hash of
+    its contents so that an image used on several pages is only stored once.
+    The image is streamed to disk rather than being read into memory.
+
+    Returns the name of the image in the store.
+
+    """
+    print("downloading {}".format(image_link))
+    if not os.path.isdir(IMAGE_STORE):
+        try:
+            os.makedirs(IMAGE_STORE)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    image_hash = hashlib.sha1()
+    img_resp = http_client.get(image_link, verify=False, stream=True)
+    tmp_path = None
+    try:
+        # Don't store error pages as images
+        img_resp.raise_for_status()
+        fd, tmp_path = tempfile.mkstemp(dir=IMAGE_STORE, prefix=".")
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in img_resp.iter_content(chunk_size=64 * 1024):
+                image_hash.update(chunk)
+                f.write(chunk)
+
+        ext = os.path.splitext(urlparse.urlparse(image_link).path)[1].lower()
+        image_name = image_hash.hexdigest() + ext
+        image_path = os.path.join(IMAGE_STORE, image_name)
+        if not os.path.isfile(image_path): # otherwise we already have this image
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, image_path)
+            tmp_path = None
+    finally:
+        img_resp.close()
+        if tmp_path and os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+    return image_name
+
+def try_download_image(image_link):
+    """Download an image into the image store, returning None if it couldn't be
+    downloaded
+    """
+    try:
+        return download_image(image_link)
+    except requests.exceptions.RequestException as ex:
+        print("Couldn't download {0}: {1}".format(image_link, ex))
+        return None
+
+def is_relative_link(link):
+    return not link.startswith("http") and not link.startswith("www") and not link.startswith("mailto")
 
-def html_to_file(dataset_name, url, pandoc_extra_args=None, dataset_conf=None, filetype="rst"):
+@instrumentation.timed("html_to_file")
+def html_to_file(dataset_name, url, pandoc_extra_args=None, dataset_urls=None, filetype="rst"):
     """Converts a url or file from html to the given pandoc filetype, saving any
-    images in the html to an image directory.
+    images in the html to the image store. dataset_urls is a dict from the url
+    of each dataset page to its key in the dataset config, used to point links
+    between dataset pages at the generated files instead.
 
     """
     print("Processing dataset {0} with url {1}".format(dataset_name, url))
-    # Should actually be using html parser...
-    link_re =  re.compile('href="(\S*)"')
-    # https://stackoverflow.com/questions/1028362/how-do-i-extract-html-img-sources-with-a-regular-expression#1028370
-    image_re = re.compile('<img[^>]+src="([^">]+)"')
-
     url_split = urlparse.urlparse(url)
     orig_path = url_split.path
     # trim the path to get the base path for the page, to replace
@@ -304,7 +496,7 @@ def html_to_file(dataset_name, url, pandoc_extra_args=None, dataset_conf=None, f
 
     # verify=false is dangerous as it ignores ssl certificates, but
     # we're not doing anything which has security risks associated.
-    response = requests.get(url, verify=False)
+    response = http_client.get(url, verify=False)
     if response.status_code == 200:
         html_text = response.text
     else:
@@ -312,103 +504,106 @@ def html_to_file(dataset_name, url, pandoc_extra_args=None, dataset_conf=None, f
         return "Could not retrieve this page."
 
     # We want to preserve images in the documentation, so we will download all
-    # the images on the page. Then, we'll replace the image references to the
-    # web with ones to the images directory we save them in
-    image_base_path = os.path.abspath("docs/datasets/images/{0}".format(dataset_name))
-    if not os.path.isdir(image_base_path):
-        os.makedirs(image_base_path)
-
-    def image_replace(match):
-        image_link = match.group(1)
+    # the images on the page to the image store. Then, we'll replace the image
+    # references to the web with ones to the stored images. First collect all
+    # the images on the page. The same image is often referenced more than
+    # once, but only needs to be downloaded once.
+    image_links = {}
+    for image_src in html_rewrite.find_attributes(html_text, "img", "src"):
         # This is a relative link, so need to construct the full url
-        if not match.group(1).startswith("http") and not match.group(1).startswith("www") and not match.group(1).startswith("mailto"):
-            image_link = base_url + "/" + image_link
-        
-        image_name = os.path.basename(urlparse.urlparse(image_link).path)
-        image_outfile = os.path.join(image_base_path, image_name)
-        
-        print("downloading {} from {}".format(image_name, image_link))
-
-        with open(image_outfile, 'w') as f:
-            img_resp = requests.get(image_link, verify=False)
-            f.write(img_resp.content)
-            
-        return match.group(0).replace(match.group(1), "images/{0}/{1}".format(dataset_name, image_name))
-
-    html_text = image_re.sub(image_replace, html_text)
+        image_links[image_src] = base_url + "/" + image_src if is_relative_link(image_src) else image_src
 
-    try:
-        # remove the directory if it's empty
-        os.rmdir(image_base_path)
+    if not image_links:
         print("There weren't any images on the page.")
-    except OSError as ex:
-        if ex.errno == errno.ENOTEMPTY:
-            pass # this means there were images downloaded
-
-    # Ensure that relative links on webpages point to the full webpage
-    def link_replace(match):
-        link = match.group(1)
-        if not match.group(1).startswith("http") and not match.group(1).startswith("www"):
-            return match.group(0).replace(match.group(1), "{}/{}".format(base_url, link))
-
-        return match.group(0)
-    
-    html_text = link_re.sub(link_replace, html_text)
-
 
-    url_dict = {dataset_conf[key]["url"]: key for key in dataset_conf.keys()}
-    def dataset_link_replace(match):
-        if match.group(1) in url_dict.keys():
-            return match.group(0).replace(match.group(1), "{}.html".format(url_dict[match.group(1)]))
-        
-        return match.group(0)
-
-    # Also want to make sure that if there is a direct link to a dataset on the
-    # page that it is converted to link to the markdown file we will generate
-    # here rather than going to somewhere else on the web. This mostly applies
-    # to the index page. Flatten the dictionary so that the key-value pairs are
-    # now the base url for the dataset page, and the dataset key (which
-    # corresponds to the markdown filename)
-    html_text = link_re.sub(dataset_link_replace, html_text)
+    # Then download them all at once
+    downloads = sorted(set(image_links.values()))
+    stored_names = {}
+    if downloads:
+        pool = ThreadPool(min(IMAGE_DOWNLOAD_WORKERS, len(downloads)))
+        try:
+            stored_names = dict(zip(downloads, pool.map(instrumentation.bind_repo(try_download_image), downloads, chunksize=1)))
+        finally:
+            pool.close()
+            pool.join()
+
+    # The dataset pages are in docs/datasets, so the store is one level up
+    store_rel_path = os.path.relpath(IMAGE_STORE, "docs/datasets")
+
+    def rewrite_attr(tag, name, value):
+        # Images which couldn't be downloaded keep linking to the web
+        if tag == "img" and name == "src" and stored_names.get(image_links.get(value)):
+            return "{0}/{1}".format(store_rel_path, stored_names[image_links[value]])
+
+        if name == "href":
+            # Ensure that relative links on webpages point to the full webpage
+            if not value.startswith("http") and not value.startswith("www"):
+                value = "{}/{}".format(base_url, value)
+            # Also want to make sure that if there is a direct link to a dataset
+            # on the page that it is converted to link to the file we will
+            # generate here rather than going to somewhere else on the web. This
+            # mostly applies to the index page.
+            if dataset_urls and value in dataset_urls:
+                value = "{}.html".format(dataset_urls[value])
+            return value
+
+        return None
+
+    # All the rewriting is done in a single pass over the page
+    html_text = html_rewrite.HtmlRewriter(rewrite_attr).rewrite(html_text)
 
     pandoc_args = ["--no-wrap"]
     if pandoc_extra_args:
         pandoc_args.extend(pandoc_extra_args)
 
-    file_text = pypandoc.convert_text(html_text, filetype, format="html", extra_args=pandoc_args).encode('utf-8')
+    file_text = pandoc_convert.convert(html_text, filetype, "html", pandoc_args)
     
     return file_text
 
-def create_dataset_docs(dataset_conf, filetype="rst"):
+def write_dataset_doc(dataset, dataset_conf, dataset_urls, filetype="rst"):
+    """Create the doc file for a single dataset in the configuration. dataset_urls
+    maps the url of each dataset in the configuration to its key.
+    """
+    dataset_file = "docs/datasets/{}.{}".format(dataset, filetype)
+    extra_args = None
+    if "pandoc_extra_args" in dataset_conf[dataset] and dataset_conf[dataset]["pandoc_extra_args"]:
+        extra_args = dataset_conf[dataset]["pandoc_extra_args"]
+    with instrumentation.repo("datasets/{}".format(dataset)):
+        file_text = html_to_file(dataset, dataset_conf[dataset]["url"], extra_args, dataset_urls, filetype)
+
+    output_files.write(dataset_file, file_text + doc_footer(dataset_conf[dataset]["url"]))
+
+def create_dataset_docs(dataset_conf, filetype="rst", jobs=1):
     """Creates dataset docs from a configuration provided, which should be found in datasets/datasets.yaml
-    Will convert html pages to markdown files.
+    Will convert html pages to markdown files. Up to jobs datasets are processed
+    at the same time.
     """
     if not os.path.isdir("docs/datasets"):
         os.makedirs("docs/datasets")
 
-    for dataset in datasets.keys():
-        dataset_file = "docs/datasets/{}.{}".format(dataset, filetype)
-        with open(dataset_file, 'w') as f:
-            extra_args = None
-            if "pandoc_extra_args" in datasets[dataset] and datasets[dataset]["pandoc_extra_args"]:
-                extra_args = datasets[dataset]["pandoc_extra_args"]
-            f.write(html_to_file(dataset, datasets[dataset]["url"], extra_args, dataset_conf, filetype))
+    # Flatten the dictionary so that the key-value pairs are now the base url
+    # for the dataset page, and the dataset key (which corresponds to the
+    # output filename). This is used to redirect links between the dataset pages.
+    dataset_urls = {dataset_conf[key]["url"]: key for key in dataset_conf.keys()}
+    write_dataset = functools.partial(write_dataset_doc, dataset_conf=dataset_conf, dataset_urls=dataset_urls, filetype=filetype)
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        try:
+            pool.map(write_dataset, dataset_conf.keys(), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for dataset in dataset_conf.keys():
+            write_dataset(dataset)
 
-        add_doc_footer(datasets[dataset]["url"], dataset_file)
-            
 
-def generate_rst_index(index_config):
-    """Generate a series of TOC sections to insert into the index.rst.
+def generate_rst_index(index_config, index=None):
+    """Generate a series of TOC sections to insert into the index.rst. index is a
+    DocsIndex of the docs directory, which is built if not given.
     """
-    rst_files = []
-    rst_dirs = set()
-    for subdir, dirs, files in os.walk("docs"):
-        for doc_file in files:
-            # ignore files in the docs directory like index, packages and setup
-            if fnmatch.fnmatch(doc_file, "*.rst") and subdir != "docs":
-                # remove docs/ and .rst before appending
-                rst_files.append(os.path.join(subdir, doc_file)[5:-4])
-                rst_dirs.add(subdir)
+    if index is None:
+        index = docs_index.DocsIndex("docs")
 
     # Base string for toctree. Use format to name the toctree
     toctree_base = """.. toctree::
@@ -421,26 +616,18 @@ def generate_rst_index(index_config):
     for toc_group in index_config:
         top_key = toc_group.keys()[0]
         toc_groups[top_key] = {"toc_string": toctree_base.format(toc_group[top_key]["caption"]),
-                               "target_dirs": toc_group[top_key]["dirs"],
-                               "toc_files": []} # files to go in this group go here
+                               "target_dirs": toc_group[top_key]["dirs"]}
 
-    for rst_dir in rst_dirs:
-        dirname = os.path.join(*rst_dir.split("/")[1:])
+    # Every directory containing rst files also gets a group of its own
+    # (files at the top level like index, packages and setup are left out)
+    for dirname in set(os.path.dirname(rst) for rst in index.files(".rst")):
         toc_groups[dirname] = {"toc_string": toctree_base.format(dirname.replace("_", " ").replace("/", " ")),
-                               "target_dirs": [dirname],
-                               "toc_files": []} # files to go in this group go here
-
-    # Go over all the rst files and put them into the correct TOC
-    for rst in sorted(rst_files):
-        # the base subdirectory of this rst file (i.e. the package it is in)
-        base_dir = rst.split("/")[0]
-        # Check all toc groups in the config to see if this file should be put
-        # in a group or in the generic TOC
-        for group_key in toc_groups.keys():
-            # Looks through all the directories that are in the given toc group
-            for toc_dir in toc_groups[group_key]["target_dirs"]:
-                if os.path.dirname(rst) == toc_dir:
-                    toc_groups[group_key]["toc_files"].append(rst)
+                               "target_dirs": [dirname]}
+
+    # Put each rst file into the groups for its directory
+    group_files = index.toc_groups({key: group["target_dirs"] for key, group in toc_groups.items()})
+    for group_key, toc_files in group_files.items():
+        toc_groups[group_key]["toc_files"] = toc_files
 
     base_toc = toctree_base.format("Introduction")
     base_toc += "   quick_setup\n   setup\n   packages\n\n\n"
@@ -457,10 +644,11 @@ def generate_rst_index(index_config):
 
     return base_toc + group_tocs
 
-def write_rst_toc_to_index(config):
+@instrumentation.timed("write_rst_toc_to_index")
+def write_rst_toc_to_index(config, index=None):
     # Modify index.rst TOC section so that all rst files are included in the documentation
     # Generate the indexes from config provided
-    rst_index = generate_rst_index(config["rst_index_config"])
+    rst_index = generate_rst_index(config["rst_index_config"], index)
 
     index = ""
     with open("docs/index.rst", 'r') as f:
@@ -473,8 +661,7 @@ def write_rst_toc_to_index(config):
         # the new TOC
         index = index[:toc_start] + rst_index
 
-    with open("docs/index.rst", 'w') as f:
-        f.write(index)
+    output_files.write("docs/index.rst", index)
 
 def clean_doc_dir(target=None):
     exclude_dirs = ["datasets", "images"]
@@ -513,18 +700,29 @@ def clean_doc_dir(target=None):
     for item in toremove:
         shutil.rmtree(item)
 
-def write_readme_files(org_name, repo_name, filetype="rst", ignore=None, header=""):
-    """Write readme files into the docs directory under their package names
+def file_unchanged(previous_files, repo_path, sha, output):
+    """Check if the file at repo_path in a repository was already written to output
+    from the same blob sha on a previous run, according to the files recorded
+    for the repository in the scrape manifest.
+
+    """
+    if not previous_files or repo_path not in previous_files:
+        return False
+
+    previous = previous_files[repo_path]
+    return previous["sha"] == sha and previous["output"] == output and os.path.isfile(output)
+
+def readme_outputs(snapshot, filetype="rst", ignore=None):
+    """Find the readme files in the repository, and work out where each should be
+    written to in the docs directory. Yields a (path in the repository, tree
+    item, output file) tuple for each of them.
+
     """
     # We look for markdown files, as readmes on github for the strands
     # repositories are written in markdown
-    readmes = get_repo_files(org_name, repo_name, match_ext=[".md"], match_filename=["readme"], ignore=ignore, header=header)
+    readmes = snapshot.get_files(match_ext=[".md"], match_filename=["readme"], ignore=ignore)
     subpkg_readmes = files_to_subpackages(readmes)
 
-    # Get the default branch for the repo, to use later when we want to link to the original files
-    repo_rq = requests.get("https://api.github.com/repos/{0}/{1}".format(org_name, repo_name), headers=header)
-    default_branch = json.loads(repo_rq.text)["default_branch"]
-
     for subpkg in subpkg_readmes.keys():
         print("processing {0}".format(subpkg))
 
@@ -536,7 +734,7 @@ def write_readme_files(org_name, repo_name, filetype="rst", ignore=None, header=
         # strands_navigation/topological_rviz_tools.{filetype}. In the case of packages
         # with multiple readmes, we will create a separate directory for them so
         # they are in their own section.
-        base_path = os.path.join("docs", repo_name)
+        base_path = os.path.join("docs", snapshot.repo_name)
 
         multiple = False
         if len(subpkg_readmes[subpkg]) > 1:
@@ -579,26 +777,250 @@ def write_readme_files(org_name, repo_name, filetype="rst", ignore=None, header=
                     # was in.
                     fname = split_path[-1] + ".{}".format(filetype)
 
-            # make sure a directory exists for the files
-            path = os.path.join(base_path, fname)
-            print("Saving {0} to {1}".format(readme[1]["path"], path))
-            if not os.path.isdir(os.path.dirname(path)):
-                os.makedirs(os.path.dirname(path))
-
-            # Get the contents of the readme file from github and output them to a file
-            file_rq = json.loads(requests.get(readme[1]["url"], headers=header).text)
-            # decode and output the base64 string to file
-            with open(path, 'w') as f:
-                if filetype == "md":
-                    f.write(base64.b64decode(file_rq["content"]))
+            yield readme[0], readme[1], os.path.join(base_path, fname)
+
+@instrumentation.timed("write_readme_files")
+def write_readme_files(snapshot, filetype="rst", ignore=None, previous_files=None):
+    """Write readme files into the docs directory under their package names.
+    Files which were written from the same blob on a previous run, according to
+    previous_files, are not downloaded again.
+
+    The files go through a pipeline, so that downloading, converting and
+    writing different files all happen at the same time.
+
+    Returns a dict of the files found, with the path in the repository as the
+    key, and the blob sha and the output file as the value.
+
+    """
+    written = {}
+
+    def changed_readmes():
+        outputs = {}
+        for repo_path, item, path in readme_outputs(snapshot, filetype, ignore):
+            # Files are written concurrently, so if two readmes end up with the
+            # same name, keep the first rather than whichever finishes last
+            if path in outputs:
+                print("{0} would overwrite {1} from {2}, skipping".format(repo_path, path, outputs[path]))
+                continue
+            outputs[path] = repo_path
+
+            written[repo_path] = {"sha": item["sha"], "output": path}
+            if file_unchanged(previous_files, repo_path, item["sha"], path):
+                print("{0} is unchanged".format(repo_path))
+                continue
+
+            print("Saving {0} to {1}".format(item["path"], path))
+            original_url = "https://github.com/{}/{}/blob/{}/{}".format(snapshot.org_name, snapshot.repo_name, snapshot.default_branch, repo_path)
+            yield path, item, original_url
+
+    def fetch(job):
+        # Get the contents of the readme file from github
+        path, item, original_url = job
+        return path, snapshot.read_file(item), original_url
+
+    def convert(job):
+        path, content, original_url = job
+        if filetype != "md":
+            content = pandoc_convert.convert(content, filetype, "md")
+        return path, content, original_url
+
+    def write(job):
+        path, content, original_url = job
+        output_files.write(path, content + doc_footer(original_url))
+
+    pipeline.Pipeline(changed_readmes())\
+            .stage(fetch, workers=FETCH_WORKERS)\
+            .stage(convert, workers=pandoc_convert.get_service().workers)\
+            .stage(write)\
+            .run()
+
+    return written
+
+class ScrapeManifest(object):
+    """Records the latest commit and wiki head that were scraped for each
+    repository, along with a hash of the ignore list and filetype they were
+    scraped with and the files that were written from them, so that
+    repositories which have not changed can be skipped on the next run. The
+    manifest is saved after every repository so that progress is not lost if
+    the scrape is interrupted.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.repos = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.repos = json.load(f)["repos"]
+
+    def get(self, repo_name):
+        return self.repos.get(repo_name)
+
+    def update(self, repo_name, entry):
+        with self.lock:
+            self.repos[repo_name] = entry
+            self._save()
+
+    def remove(self, repo_name):
+        with self.lock:
+            self.repos.pop(repo_name, None)
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"repos": self.repos}, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+def scrape_settings(ignore, filetype):
+    """Hash of the settings which decide which files are scraped from a repository
+    and how they are written, so that a repository can be scraped again when
+    they change
+    """
+    settings = {"ignore": file_rules.IgnoreRules.compile(ignore).entries, "filetype": filetype}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()
+
+def manifest_outputs(entry):
+    """Get a list of all the output files recorded in a manifest entry
+    """
+    return [item["output"] for item in entry["wiki_files"].values() + entry["files"].values()]
+
+def remove_outputs(outputs):
+    """Remove output files which no longer have a source
+    """
+    for output in sorted(outputs):
+        if output_files.remove(output):
+            print("Removed {}, which no longer has a source".format(output))
+
+def scrape_repo(org_name, repo_name, repo_data=None, ignore_repos=[], ignore_files={}, filetype="rst", nowiki=False, manifest=None, force=False, mirror_dir=None, wiki_clone_dir="wikis"):
+    """Scrape the wiki, readme files and package xmls of a single repository into
+    docs/repo_name. repo_data is the entry for the repository returned by
+    get_org_repo_dict, if available.
+
+    If mirror_dir is given, the repository contents are read from a local
+    mirror of the repository kept in that directory, instead of from the github
+    api.
+
+    Shallow clones of wikis are kept in wiki_clone_dir between runs, so that
+    only new commits need to be fetched.
+
+    If a manifest is given, the repository is skipped if neither its latest
+    commit, its wiki, nor its ignore list and the filetype have changed since
+    the last run, and files which have not changed are not downloaded again. With force, everything is scraped
+    regardless of the manifest.
+
+    """
+    print("-------------------- {0} --------------------".format(repo_name))
+    if repo_name in ignore_repos: # ignores entire repositories, since it cannot see the keys for dicts in the list
+        print("ignoring repo".format(repo_name))
+        return
+
+    ignore_list = []
+    if repo_name in ignore_files:
+        ignore_list = ignore_files[repo_name]
+
+    recorded = manifest.get(repo_name) if manifest else None
+    # If the ignore list or filetype changed since the last run, nothing
+    # recorded can be reused, since files may now be ignored or written
+    # differently
+    settings = scrape_settings(ignore_list, filetype)
+    settings_changed = recorded is not None and recorded.get("settings") != settings
+    previous = recorded if not force and not settings_changed else None
+    # The commit and tree are only retrieved once, and shared by everything below
+    if mirror_dir:
+        snapshot = MirrorSnapshot(org_name, repo_name, mirror_dir, repo_data)
+    else:
+        snapshot = RepoSnapshot(org_name, repo_name, repo_data)
+    latest_sha = snapshot.sha
+    wiki_head = None if nowiki else get_wiki_head(org_name, repo_name)
+
+    if previous and previous["sha"] == latest_sha and (nowiki or previous["wiki_head"] == wiki_head)\
+       and all(os.path.isfile(output) for output in manifest_outputs(previous)):
+        print("{0} has not changed since the last scrape".format(repo_name))
+        return
+
+    entry = {"sha": latest_sha,
+             "settings": settings,
+             "wiki_head": wiki_head,
+             "wiki_files": {},
+             "files": {}}
+
+    if nowiki:
+        # The wiki wasn't checked, so keep what was recorded for it rather than
+        # removing its pages below, even when everything else is scraped again
+        if recorded:
+            # Pages written with different settings are converted again the
+            # next time the wiki is checked
+            entry["wiki_head"] = recorded["wiki_head"] if not settings_changed else None
+            entry["wiki_files"] = recorded["wiki_files"]
+    elif wiki_head:
+        # Clone the wiki repo for this repo into the docs subdirectory for the repo
+        entry["wiki_files"] = previous["wiki_files"] if previous else {}
+        wiki_unchanged = previous and previous["wiki_head"] == wiki_head\
+                         and all(os.path.isfile(item["output"]) for item in previous["wiki_files"].values())
+        if not wiki_unchanged:
+            entry["wiki_files"] = get_wiki(org_name, repo_name, os.path.join(wiki_clone_dir, repo_name),
+                                           filetype=filetype, ignore=ignore_list,
+                                           previous_files=previous["wiki_files"] if previous else None)
+
+    previous_files = previous["files"] if previous else None
+
+    # Find readme (or markdown) files in the repository and write them to
+    # the subdirectory, preserving some of the directory structure of the repo.
+    entry["files"].update(write_readme_files(snapshot, filetype=filetype, ignore=ignore_list,
+                                             previous_files=previous_files))
+
+    package_xml = snapshot.get_files(match_full=["package.xml"], ignore=ignore_list)
+    subpkg_xml = files_to_subpackages(package_xml)
+
+    base_path = os.path.join("docs", repo_name)
+    for subpkg in subpkg_xml.keys():
+        multiple = len(subpkg_xml[subpkg]) > 1
+        for pkg_xml in subpkg_xml[subpkg]:
+            split_path = path_to_arr(os.path.dirname(pkg_xml[0]))
+            if multiple:
+                # There is more than one file in the subpackage
+                if len(split_path) <= 1:
+                    fname = "package.xml"
                 else:
-                    f.write(pypandoc.convert_text(base64.b64decode(file_rq["content"]),
-                                                  filetype,
-                                                  format="md").encode('utf-8'))
+                    # The path is long, so the file was nested deeper than
+                    # level 1 in the tree. We will rename it to the name of
+                    # the directory that it was in.
+                    print("path is long: {0}".format(split_path))
+                    fname = split_path[-1] + ".xml"
+            else:
+                # There is only one file in the subpackage. If the split
+                # path length is zero, that means it was a toplevel readme,
+                # so rename it to index so it's parsed differently by the
+                # documentation code.
+                if len(split_path) == 0:
+                    fname = "package.xml"
+                else:
+                    # Otherwise, rename it to the name of the directory it
+                    # was in.
+                    fname = split_path[-1] + ".xml"
+
+            if len(split_path) > 1:
+                path = os.path.join(base_path, os.path.join(*split_path[:-1]), fname)
+            else:
+                path = os.path.join(base_path, fname)
+
+            entry["files"][pkg_xml[0]] = {"sha": pkg_xml[1]["sha"], "output": path}
+            if file_unchanged(previous_files, pkg_xml[0], pkg_xml[1]["sha"], path):
+                print("{0} is unchanged".format(pkg_xml[0]))
+                continue
+
+            print("Saving {0} to {1}".format(pkg_xml[1]["path"], path))
+            # Get the contents of the package.xml file from github and output them to a file
+            output_files.write(path, snapshot.read_file(pkg_xml[1]))
 
+    # Remove anything written on the last run which no longer has a source, e.g.
+    # readmes which were deleted or moved in the repository
+    if recorded:
+        remove_outputs(set(manifest_outputs(recorded)) - set(manifest_outputs(entry)))
 
-            original_url = "https://github.com/{}/{}/blob/{}/{}".format(org_name, repo_name, default_branch, readme[0])
-            add_doc_footer(original_url, path)
+    if manifest:
+        manifest.update(repo_name, entry)
 
 if __name__ == '__main__':
     org = "strands-project"
@@ -613,9 +1035,46 @@ if __name__ == '__main__':
     parser.add_argument("--single-package", action="store", type=str, help="Use to specify a single package to update")
     parser.add_argument("--filetype", action="store_true", default="rst", help="Specify the filetype for output. This should be a valid pandoc output format. This is used to define which format files scraped from the github repositories, or from the web in the case of datasets, are converted to when they are copied to the docs directory. Default is to output to rst, for use in readthedocs.")
     parser.add_argument("--rst-index-toc", action="store_true", help="Regenerate the rst TOC for the docs/index.rst file")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of repositories (or datasets, with --datasets) to scrape concurrently. Default is 1, which processes them one at a time.")
+    parser.add_argument("--pool-size", type=int, default=http_client.DEFAULT_POOL_SIZE, help="Maximum number of connections to keep open to each host. Will be at least the number of jobs.")
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.expanduser("~"), ".cache", "strands_documentation"), help="Directory in which to cache responses from github, pandoc conversions, package descriptions and clones of wikis between runs. Default is ~/.cache/strands_documentation.")
+    parser.add_argument("--cache-size", type=int, default=512, help="Maximum size of the response and conversion caches in megabytes. Least recently used entries are removed when they are full.")
+    parser.add_argument("--no-cache", action="store_true", help="Don't cache responses from github or pandoc conversions.")
+    parser.add_argument("--manifest", default="docs/_scrape_manifest.json", help="File in which to record the commits that were scraped from each repository. Repositories which have not changed since the last run are skipped. Default is docs/_scrape_manifest.json.")
+    parser.add_argument("--full", action="store_true", help="Scrape all repositories, even those which have not changed since the last run.")
+    parser.add_argument("--mirror-dir", help="Keep bare git mirrors of the repositories in this directory, and read trees and files from them instead of making requests to the github api for each file.")
+    parser.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS, help="Number of files to download at once from each repository. Default is {}.".format(FETCH_WORKERS))
+    parser.add_argument("--pandoc-workers", type=int, help="Number of pandoc conversions to run at once. Default is the number of cores.")
+    parser.add_argument("--profile", metavar="REPORT", help="Write a json report of the time spent in each phase of the scrape, the number of requests, bytes downloaded, cache hits and pandoc conversions, overall and for each repository, to the given file.")
+    parser.add_argument("--cprofile", metavar="FILE", help="Also profile the run with cProfile and dump the stats to the given file. Only the main thread is profiled, so use with --jobs 1.")
+    parser.add_argument("--api-url", default=GITHUB_API, help="Base url of the github api. Default is {}.".format(GITHUB_API))
+    parser.add_argument("--git-url", default=GIT_URL, help="Base url from which to clone repositories and wikis, which are expected at <git-url>/<org>/<repo>.wiki.git. Default is {}.".format(GIT_URL))
+    parser.add_argument("--org", default=org, help="The github organisation to scrape. Default is {}.".format(org))
+    parser.add_argument("--changes", default="docs/_changed_outputs.json", help="File in which to record the docs files which were changed, created or removed, which scripts/build_docs.py uses to decide whether to regenerate the TOC. Changes from several runs are added together until the docs are built. Default is docs/_changed_outputs.json.")
     parser.add_argument("--clean", action="store_true", help="Remove directories from the docs directory to give a clean slate.")
 
     args = parser.parse_args()
+    GITHUB_API = args.api_url.rstrip("/")
+    GIT_URL = args.git_url.rstrip("/")
+    FETCH_WORKERS = args.fetch_workers
+    org = args.org
+
+    # Saved on exit, since several of the modes below finish with sys.exit
+    atexit.register(output_files.writer.save_changes, args.changes)
+
+    if args.profile or args.cprofile:
+        profiler = cProfile.Profile() if args.cprofile else None
+        def write_profile():
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.cprofile)
+            if args.profile:
+                instrumentation.recorder.write_report(args.profile, rate_limit=http_client.quota())
+                print("Wrote scrape profile to {}".format(args.profile))
+        # Written on exit, since several of the modes below finish with sys.exit
+        atexit.register(write_profile)
+        if profiler:
+            profiler.enable()
 
     with open(args.conf, 'r') as f:
         config = yaml.safe_load(f.read())
@@ -624,101 +1083,99 @@ if __name__ == '__main__':
 
     # Go through the list of ignored repos and extract the dictionaries which
     # correspond to repositories which have files in them that should be
-    # ignored.
+    # ignored. The lists are compiled once here rather than being checked entry
+    # by entry against every file.
     for repo in ignore_repos:
         if type(repo) is dict:
             repo_name = repo.keys()[0]
-            ignore_files[repo_name] = repo[repo_name]
+            ignore_files[repo_name] = file_rules.IgnoreRules(repo[repo_name])
+
+    pandoc_convert.configure(args.pandoc_workers,
+                             cache_dir=None if args.no_cache else os.path.join(args.cache_dir, "pandoc"),
+                             cache_size=args.cache_size * 1024 * 1024)
 
     if args.datasets:
         datasets = {}
         with open("conf/datasets.yaml") as f:
             datasets = yaml.safe_load(f.read())["datasets"]
 
-        create_dataset_docs(datasets, filetype=args.filetype)
+        create_dataset_docs(datasets, filetype=args.filetype, jobs=args.jobs)
         sys.exit(0)
 
+    # Descriptions parsed from package xmls are cached between runs
+    index_cache = None if args.no_cache else os.path.join(args.cache_dir, "docs_index.json")
+
     if args.package_index:
-        create_package_file()
+        create_package_file(index=docs_index.DocsIndex("docs", index_cache))
         sys.exit(0)
 
     if args.rst_index_toc:
-        write_rst_toc_to_index(config)
+        write_rst_toc_to_index(config, docs_index.DocsIndex("docs", index_cache))
         sys.exit(0)
 
     if args.clean:
         clean_doc_dir()
         sys.exit(0)
 
+    # All requests share a single pooled session, so the auth header only
+    # needs to be attached once here
     header = get_oauth_header(args.private)
-    repos = get_org_repo_dict(org, header)
+    http_client.configure(headers=header, pool_size=max(args.pool_size, args.jobs),
+                          cache_dir=None if args.no_cache else os.path.join(args.cache_dir, "http"),
+                          cache_size=args.cache_size * 1024 * 1024)
+    repos = get_org_repo_dict(org)
 
     # This is where the bulk of the work is done. We check each repository for
     # readme files and see if it has a wiki. If we find files there, we copy them
     # and put them in directories corresponding to the name of the repository
     packages = sorted(repos.keys()) if not args.single_package else [args.single_package]
-    for repo_name in packages:
-        print("-------------------- {0} --------------------".format(repo_name))
-        if repo_name in ignore_repos: # ignores entire repositories, since it cannot see the keys for dicts in the list
-            print("ignoring repo".format(repo_name))
-            continue
-
-        ignore_list = []
-        if repo_name in ignore_files:
-            ignore_list = ignore_files[repo_name]
-
-        # Clone the wiki repo for this repo into the docs subdirectory for the repo
-        if not args.nowiki:
-            get_wiki(org, repo_name, filetype=args.filetype, ignore=ignore_list)
-
-        # Find readme (or markdown) files in the repository and write them to
-        # the subdirectory, preserving some of the directory structure of the repo.
-        write_readme_files(org, repo_name, filetype=args.filetype, ignore=ignore_list, header=header)
-
-        package_xml = get_repo_files(org, repo_name, match_full=["package.xml".format(repo_name)], ignore=ignore_list, header=header)
-        subpkg_xml = files_to_subpackages(package_xml)
-
-        base_path = os.path.join("docs", repo_name)
-        for subpkg in subpkg_xml.keys():
-            multiple = len(subpkg_xml[subpkg]) > 1
-            for pkg_xml in subpkg_xml[subpkg]:
-                split_path = path_to_arr(os.path.dirname(pkg_xml[0]))
-                if multiple:
-                    # There is more than one file in the subpackage
-                    if len(split_path) <= 1:
-                        fname = "package.xml"
-                    else:
-                        # The path is long, so the file was nested deeper than
-                        # level 1 in the tree. We will rename it to the name of
-                        # the directory that it was in.
-                        print("path is long: {0}".format(split_path))
-                        fname = split_path[-1] + ".xml"
-                else:
-                    # There is only one file in the subpackage. If the split
-                    # path length is zero, that means it was a toplevel readme,
-                    # so rename it to index so it's parsed differently by the
-                    # documentation code.
-                    if len(split_path) == 0:
-                        fname = "package.xml"
-                    else:
-                        # Otherwise, rename it to the name of the directory it
-                        # was in.
-                        fname = split_path[-1] + ".xml"
-
-                if len(split_path) > 1:
-                    path = os.path.join(base_path, os.path.join(*split_path[:-1]), fname)
-                else:
-                    path = os.path.join(base_path, fname)
-
-                print("Saving {0} to {1}".format(pkg_xml[1]["path"], path))
-                if not os.path.isdir(os.path.dirname(path)):
-                    os.makedirs(os.path.dirname(path))
-
-                # Get the contents of the package.xml file from github and output them to a file
-                file_rq = json.loads(requests.get(pkg_xml[1]["url"], headers=header).text)
-                with open(path, 'w') as f:
-                    f.write(base64.b64decode(file_rq["content"]))
-
-    create_package_file()
+    manifest = ScrapeManifest(args.manifest)
+    failed = []
+    def scrape(repo_name):
+        # A repository which fails is not recorded in the manifest, so it will be
+        # scraped again on the next run. Don't let it stop the others.
+        try:
+            with instrumentation.repo(repo_name), instrumentation.phase("scrape_repo"):
+                scrape_repo(org, repo_name, repo_data=repos.get(repo_name), ignore_repos=ignore_repos, ignore_files=ignore_files,
+                            filetype=args.filetype, nowiki=args.nowiki, manifest=manifest, force=args.full,
+                            mirror_dir=args.mirror_dir, wiki_clone_dir=os.path.join(args.cache_dir, "wikis"))
+        except (requests.exceptions.RequestException, subprocess.CalledProcessError) as ex:
+            print("Failed to scrape {0}: {1}".format(repo_name, ex))
+            failed.append(repo_name)
+
+    if args.jobs > 1:
+        # Each repository writes only to its own docs/<repo_name> directory, so
+        # they can safely be processed concurrently. The work is almost entirely
+        # waiting on the network or on pandoc, so threads are enough.
+        pool = ThreadPool(args.jobs)
+        try:
+            pool.map(scrape, packages, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for repo_name in packages:
+            scrape(repo_name)
+
+    quota = http_client.quota()
+    if quota["remaining"] is not None:
+        print("Github rate limit: {0}/{1} requests remaining".format(quota["remaining"], quota["limit"]))
+    if failed:
+        print("Failed to scrape {0} repositories: {1}".format(len(failed), ", ".join(sorted(failed))))
+
+    # Remove the outputs of repositories which were scraped before, but have
+    # since been deleted from the organisation or added to the ignore list
+    if not args.single_package:
+        for repo_name in sorted(manifest.repos.keys()):
+            if repo_name not in repos or repo_name in ignore_repos:
+                print("{0} is no longer scraped, removing its docs".format(repo_name))
+                remove_outputs(manifest_outputs(manifest.get(repo_name)))
+                manifest.remove(repo_name)
+
+    # The package file is written at the top level of the docs directory, which
+    # isn't part of the TOC, so both can use the same index
+    with instrumentation.phase("index_docs"):
+        index = docs_index.DocsIndex("docs", index_cache)
+    create_package_file(index=index)
     if args.filetype == "rst":
-        write_rst_toc_to_index(config)
+        write_rst_toc_to_index(config, index)
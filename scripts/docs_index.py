@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# An index of the files in the docs directory, built with a single walk of the
+# tree, which is shared by everything that generates pages listing the docs
+# (the package list and the TOC in index.rst) instead of each of them walking
+# the tree again.
+#
+# Package descriptions are parsed from the package xml files as the tree is
+# walked. If a cache file is given, the descriptions are stored there along with
+# the modification time and size of the xml they came from, so that on the next
+# run only xml files which have changed are parsed again.
+
+import os
+import json
+import xml.etree.ElementTree as ET
+
+def get_package_xml_description(xml):
+    root = ET.fromstring(xml)
+    return root.findall("description")[0].text
+
+class DocsIndex(object):
+    """The files in docs_dir, grouped by directory, along with the descriptions
+    from the package xml files. Directories are relative to docs_dir, and the
+    top level directory is the empty string.
+
+    """
+    def __init__(self, docs_dir="docs", cache_path=None):
+        self.docs_dir = docs_dir
+        self.cache_path = cache_path
+        self.dirs = {}
+        self.descriptions = {}
+        self._build()
+
+    def _load_cache(self):
+        if self.cache_path and os.path.isfile(self.cache_path):
+            with open(self.cache_path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _save_cache(self, cache):
+        if not self.cache_path:
+            return
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.cache_path)
+
+    def _description(self, path, cache, new_cache):
+        # Cached by absolute path so that a cache shared between checkouts
+        # doesn't mix them up
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = cache.get(key)
+        if cached and cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size:
+            description = cached["description"]
+        else:
+            with open(path, 'r') as f:
+                description = get_package_xml_description(f.read())
+        new_cache[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "description": description}
+        return description
+
+    def _build(self):
+        cache = self._load_cache()
+        new_cache = {}
+        for subdir, dirs, files in os.walk(self.docs_dir):
+            dirpath = os.path.relpath(subdir, self.docs_dir)
+            if dirpath == ".":
+                dirpath = ""
+            self.dirs[dirpath] = sorted(files)
+
+            # Package xmls at the top level aren't part of any package
+            if not dirpath:
+                continue
+            for doc_file in files:
+                fname, ext = os.path.splitext(doc_file)
+                if ext != ".xml":
+                    continue
+                # The package.xml describes the directory it is in, other xml
+                # files were saved under the name of their subpackage
+                key = dirpath if fname == "package" else os.path.join(dirpath, fname)
+                self.descriptions[key] = self._description(os.path.join(subdir, doc_file), cache, new_cache)
+
+        # Only keep entries for files which still exist
+        if new_cache != cache:
+            self._save_cache(new_cache)
+
+    def subdirs(self):
+        """All directories below the top level, in sorted order, so that a
+        directory always comes before the directories inside it
+        """
+        return sorted(dirpath for dirpath in self.dirs if dirpath)
+
+    def files(self, ext):
+        """Paths relative to docs_dir of the files with the given extension which
+        are not at the top level, in sorted order
+        """
+        paths = []
+        for dirpath in self.subdirs():
+            paths.extend(os.path.join(dirpath, doc_file) for doc_file in self.dirs[dirpath] if doc_file.endswith(ext))
+        return paths
+
+    def description(self, dirpath):
+        """The description of the package documented in dirpath, if there is one.
+        The package xml may also be in a directory of the same name inside it,
+        e.g. in aaf_deployment, the readme for info_terminal is at
+        aaf_deployment/info_terminal/readme.md, and package xml is at
+        aaf_deployment/info_terminal/info_terminal/package.xml
+
+        """
+        if dirpath in self.descriptions:
+            return self.descriptions[dirpath]
+        return self.descriptions.get(os.path.join(dirpath, os.path.basename(dirpath)))
+
+    def package_links(self, filetype="rst"):
+        """Get the index file of each package and subpackage, grouped by the top
+        level directory of the package. Returns a dict of lists of (dirpath,
+        index file) tuples, in which the package itself comes first.
+
+        """
+        index_name = "index.{}".format(filetype)
+        links = {}
+        for dirpath in self.subdirs():
+            if index_name in self.dirs[dirpath]:
+                top_dir = dirpath.split(os.sep)[0]
+                links.setdefault(top_dir, []).append((dirpath, os.path.join(dirpath, index_name)))
+        return links
+
+    def toc_groups(self, groups):
+        """Assign files to TOC groups. groups is a dict of lists of the
+        directories that each group contains. Returns a dict with the list of
+        files, without extension, in each group.
+
+        Each file is placed in every group containing the directory it is in.
+
+        """
+        dir_groups = {}
+        for group_key, target_dirs in groups.items():
+            for target_dir in target_dirs:
+                dir_groups.setdefault(target_dir, []).append(group_key)
+
+        group_files = {group_key: [] for group_key in groups}
+        for rst in sorted(self.files(".rst")):
+            name = os.path.splitext(rst)[0]
+            for group_key in dir_groups.get(os.path.dirname(rst), []):
+                group_files[group_key].append(name)
+
+        return group_files
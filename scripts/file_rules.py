@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Rules for choosing which files in a repository to scrape. The names and
+# extensions to look for, and the ignore list for the repository from
+# conf/conf.yaml, are compiled once into a rule object, so that filtering a tree
+# costs a couple of set lookups and a single regular expression search per
+# file, however many rules there are.
+
+import os
+import re
+import fnmatch
+
+GLOB_CHARS = re.compile(r"[*?[]")
+
+class IgnoreRules(object):
+    """Compiled ignore list. Entries are matched as substrings of a path, as
+    they always have been, except for entries containing glob characters (*, ?
+    or [), which must match the whole path.
+
+    """
+    def __init__(self, entries):
+        self.entries = list(entries or [])
+        substrings = [re.escape(entry) for entry in self.entries if not GLOB_CHARS.search(entry)]
+        globs = [fnmatch.translate(entry) for entry in self.entries if GLOB_CHARS.search(entry)]
+        self.substring_re = re.compile("|".join(substrings)) if substrings else None
+        self.glob_re = re.compile("|".join("(?:{0})".format(glob) for glob in globs)) if globs else None
+
+    @classmethod
+    def compile(cls, entries):
+        """Compile a list of ignore entries, or return them as they are if they
+        are already compiled
+        """
+        if isinstance(entries, cls):
+            return entries
+        return cls(entries)
+
+    def __nonzero__(self):
+        return bool(self.entries)
+
+    def matches(self, path):
+        if self.substring_re and self.substring_re.search(path):
+            return True
+        return bool(self.glob_re and self.glob_re.match(path))
+
+class FileMatcher(object):
+    """Matches file paths against lists of extensions, filenames without an
+    extension, and full filenames. Comparisons ignore case.
+    """
+    def __init__(self, match_ext=(), match_filename=(), match_full=()):
+        self.extensions = set(ext.lower() for ext in match_ext)
+        self.filenames = set(name.lower() for name in match_filename)
+        self.full_names = set(name.lower() for name in match_full)
+
+    def matches(self, path):
+        basename = path[path.rfind("/") + 1:].lower()
+        name, ext = os.path.splitext(basename)
+        return ext in self.extensions or name in self.filenames or basename in self.full_names
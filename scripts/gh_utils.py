@@ -11,27 +11,17 @@ from xml.dom.minidom import parseString
 import sys
 import os
 import subprocess
-import re
+import sqlite3
+import argparse
+import urllib
+import http_client
 
-user = sys.argv[1]
-password = sys.argv[2]
-
-auth = (user,password)
-
-def get_list(url, session=None):
-    if session is None:
-        session = requests.Session()
-    r = session.get(url,auth=auth)
-    
-    if(r.ok):
-        lst = json.loads(r.content)
-        if "link" in r.headers and r.headers['link'] !="":
-            next_search=re.search("<(.*)>; rel=\"next\"", r.headers['link'],re.IGNORECASE)
-            if next_search is not None:
-                next=next_search.group(1)
-                print next
-                lst.extend(get_list(next))
-    return lst
+def get_list(url):
+    """
+    Gets all the items in a paginated listing. Pages after the first are
+    fetched concurrently
+    """
+    return list(http_client.paginate(url))
 
 
 def get_repos():
@@ -40,7 +30,7 @@ def get_repos():
     Return list of dictionaries
     """
     return get_list('https://api.github.com/orgs/strands-project/repos')
-    # r = requests.get('https://api.github.com/orgs/strands-project/repos',auth=auth)
+    # r = http_client.get('https://api.github.com/orgs/strands-project/repos')
     # if(r.ok):
     #     repos = json.loads(r.content)
     #     return repos
@@ -50,7 +40,7 @@ def get_repo_tree(repo, sha):
     """
     Gets the tree structure of te given repo at the give sha revision
     """
-    r = requests.get('https://api.github.com/repos/strands-project/%s/git/trees/%s?recursive=1'%(repo,sha),auth=auth)
+    r = http_client.get('https://api.github.com/repos/strands-project/%s/git/trees/%s?recursive=1'%(repo,sha))
     if(r.ok):
         repos = json.loads(r.content)
         return repos
@@ -60,23 +50,143 @@ def get_file(repo, filepath):
     """
     Gets the contents of a file in the given repo
     """
-    r = requests.get('https://api.github.com/repos/strands-project/%s/contents/%s?recursive=1'%(repo,filepath),auth=auth)
+    r = http_client.get('https://api.github.com/repos/strands-project/%s/contents/%s?recursive=1'%(repo,filepath))
     if(r.ok):
         repos = json.loads(r.content)
         return base64.b64decode(repos["content"])
     return None
 
 
-def get_commits(repo):
-    return get_list('https://api.github.com/repos/strands-project/%s/commits?since=2016-04-01T00:00:00Z&until=2018-04-01T00:00:00Z'%(repo))
-
-
+def get_commits(repo, since=None, until=None):
+    """
+    Gets the commits in the given repo, optionally only those between the
+    since and until timestamps. Yields commits as the pages arrive
+    """
+    params = {}
+    if since:
+        params["since"] = since
+    if until:
+        params["until"] = until
+    url = 'https://api.github.com/repos/strands-project/%s/commits'%(repo)
+    if params:
+        url += '?' + urllib.urlencode(params)
+    return http_client.paginate(url)
+
+
+class CommitStore(object):
+    """
+    Local sqlite store of the commits in each repository, so that the
+    statistics can be updated incrementally rather than fetching the whole
+    history every time
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS commits (
+                repo TEXT NOT NULL,
+                sha TEXT NOT NULL,
+                committer TEXT,
+                email TEXT,
+                date TEXT NOT NULL,
+                PRIMARY KEY (repo, sha)
+            );
+            CREATE TABLE IF NOT EXISTS repos (
+                name TEXT PRIMARY KEY,
+                last_date TEXT
+            );
+            CREATE INDEX IF NOT EXISTS commits_committer ON commits (committer, date);
+            CREATE INDEX IF NOT EXISTS commits_repo_date ON commits (repo, date);
+            CREATE INDEX IF NOT EXISTS commits_date ON commits (date);
+        """)
+
+    def last_date(self, repo):
+        """
+        Timestamp of the newest commit stored for the repo, or None
+        """
+        row = self.db.execute("SELECT last_date FROM repos WHERE name = ?", (repo,)).fetchone()
+        return row[0] if row else None
+
+    def update_repo(self, repo):
+        """
+        Fetch the commits made since the last update of the repo and store them.
+        The repo is committed to the database as a whole, so if this is
+        interrupted the repo is just fetched again from the same point next time
+        """
+        since = self.last_date(repo)
+        changes = self.db.total_changes
+        for c in get_commits(repo, since=since):
+            committer = c['commit']['committer']
+            # since is inclusive, so the newest stored commit comes back again
+            self.db.execute("INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?, ?)",
+                            (repo, c['sha'], committer['name'], committer['email'], committer['date']))
+        new_commits = self.db.total_changes - changes
+        self.db.execute("INSERT OR REPLACE INTO repos VALUES (?, (SELECT MAX(date) FROM commits WHERE repo = ?))",
+                        (repo, repo))
+        self.db.commit()
+        return new_commits
+
+    def _counts(self, column, since=None, until=None):
+        query = "SELECT %s, COUNT(*) FROM commits WHERE date >= ? AND date < ? GROUP BY 1 ORDER BY 2 DESC, 1"%(column)
+        return self.db.execute(query, (since or "", until or "9999")).fetchall()
+
+    def committer_counts(self, since=None, until=None):
+        return self._counts("committer", since, until)
+
+    def repo_counts(self, since=None, until=None):
+        return self._counts("repo", since, until)
+
+    def monthly_counts(self, since=None, until=None):
+        # dates are ISO 8601, so the first 7 characters are the year and month
+        return sorted(self._counts("substr(date, 1, 7)", since, until))
+
+
+def print_counts(title, counts):
+    print
+    print title
+    for name, count in counts:
+        print " ", name, "  ", count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Utilities for the strands-project github organisation. Lists the repositories by default.")
+    parser.add_argument("user", help="Github username")
+    parser.add_argument("password", help="Github password or token")
+    parser.add_argument("--stats", metavar="DB", help="Update the commit statistics stored in the given sqlite database, and print the number of commits per committer, per repository and per month.")
+    parser.add_argument("--since", default="2016-04-01T00:00:00Z", help="Start of the period to report statistics for")
+    parser.add_argument("--until", default="2018-04-01T00:00:00Z", help="End of the period to report statistics for")
+    parser.add_argument("--no-update", action="store_true", help="Report the statistics already in the database without fetching new commits")
+    args = parser.parse_args()
+
+    # Attach the credentials once, all requests then share the same pooled session
+    http_client.configure(auth=(args.user, args.password))
+
+    print "Getting repos..."
+    repos=get_repos()
+
+    if not args.stats:
+        print "Repos: "
+        for i in repos:
+            print " - ",i['name']
+        sys.exit(0)
+
+    store = CommitStore(args.stats)
+    if not args.no_update:
+        for i,repo in enumerate(repos):
+            r=repo['name']
+            print i+1,'/',len(repos), '   ', r, ' since ', store.last_date(r)
+            try:
+                print "new commits: ", store.update_repo(r)
+            except requests.exceptions.HTTPError as ex:
+                # empty repositories give a 409 for their commits
+                print "could not get commits: ", ex
+
+    print_counts("Commits per committer", store.committer_counts(args.since, args.until))
+    print_counts("Commits per repository", store.repo_counts(args.since, args.until))
+    print_counts("Commits per month", store.monthly_counts(args.since, args.until))
 
 # Checkout latest version locally
 #URLS=[]
-#COMMITTERS={}
 #repos=get_repos()
-#rep_coms={}
 #for i,repo in enumerate(repos):
 #    r=repo['name']
 #    print i+1,'/',len(repos), '   ', r
@@ -89,64 +199,3 @@ def get_commits(repo):
 #        os.chdir("..")
 #    else:
 #        subprocess.call(["git","clone",URL])
-
-
-# repos=get_repos()
-# for i,repo in enumerate(repos):
-#     r=repo['name']
-#     print i+1,'/',len(repos), '   ', r
-    
-#import sys
-#sys.exit(1)
-
-URLS=[]
-COMMITTERS={}
-print "Getting repos..."
-repos=get_repos()
-print "Repos: "
-for i in repos:
-    print " - ",i['name']
-
-
-
-# rep_coms={}
-# for i,repo in enumerate(repos):
-#     r=repo['name']
-#     print i+1,'/',len(repos), '   ', r
-#     URLS.append(( repo["clone_url"],
-#                   repo["name"]) )
-#     commits=get_commits(r)
-#     print "number of commits: ", len(commits)
-#     rep_coms[r]=commits
-#     for c in commits:
-#         nm=c['commit']['committer']['name']
-#         if not COMMITTERS.has_key(nm):
-#             COMMITTERS[nm]=0
-#         COMMITTERS[nm]+=1
-
-# #    k=raw_input("Nex?")
-# #    if k=="no":
-# #        break
-
-# import pickle
-# f=open("committers","w")
-# f.write(pickle.dumps(COMMITTERS))
-# f.close()
-
-# f=open("repo_commits","w")
-# f.write(pickle.dumps(rep_coms))
-# f.close()
-# for c in COMMITTERS:
-#     print c,"  ",COMMITTERS[c]
-
-# # Checkout latest version locally
-# # for URL, name in URLS:
-# #     if os.path.isdir(name):
-# #         os.chdir(name)
-# #         subprocess.call(["git","pull"])
-# #         os.chdir("..")
-# #     else:
-# #         subprocess.call(["git","clone",URL])
-
-
-    
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# Keeps bare mirrors of git repositories in a local directory, and answers
+# questions about their contents using git plumbing commands. Once a mirror has
+# been cloned, keeping it up to date only needs a single fetch, rather than a
+# request to the github api for every tree and file.
+
+import os
+import subprocess
+
+class GitMirror(object):
+    """A bare mirror of the repository at url, kept in mirror_dir/name.git
+    """
+    def __init__(self, mirror_dir, name, url):
+        self.url = url
+        self.path = os.path.join(mirror_dir, name + ".git")
+
+    def git(self, *args):
+        return subprocess.check_output(["git", "--git-dir", self.path] + list(args))
+
+    def update(self):
+        """Clone the mirror if it doesn't exist yet, otherwise fetch any changes
+        """
+        if os.path.isdir(self.path):
+            print("Updating mirror of {0}".format(self.url))
+            self.git("fetch", "--prune", "--quiet", "origin")
+        else:
+            print("Cloning mirror of {0} to {1}".format(self.url, self.path))
+            subprocess.check_call(["git", "clone", "--mirror", "--quiet", self.url, self.path])
+
+    def default_branch(self):
+        """The branch that HEAD points to in the mirrored repository
+        """
+        return self.git("symbolic-ref", "--short", "HEAD").strip()
+
+    def rev_parse(self, ref="HEAD"):
+        """Get the commit sha that the given ref points to
+        """
+        return self.git("rev-parse", "{0}^{{commit}}".format(ref)).strip()
+
+    def ls_tree(self, ref="HEAD"):
+        """List all files in the tree of the given ref. Items are dicts with the
+        same path, mode, type and sha keys as items in a tree from the github
+        api.
+
+        """
+        tree = []
+        # -z separates entries with NUL and doesn't quote unusual paths
+        for entry in self.git("ls-tree", "-r", "-z", "--full-tree", ref).split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            mode, obj_type, sha = info.split()
+            tree.append({"path": path, "mode": mode, "type": obj_type, "sha": sha})
+
+        return tree
+
+    def read_blob(self, sha):
+        """Get the contents of the blob with the given sha
+        """
+        return self.git("cat-file", "blob", sha)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Rewrites attributes in an html document in a single pass using the standard
+# library html tokenizer. Unlike regular expressions over the raw text, this
+# handles single quoted, unquoted and multiline attribute values, and attributes
+# in any order. Everything that isn't rewritten is passed through unchanged.
+
+from __future__ import unicode_literals
+import cgi
+from HTMLParser import HTMLParser
+
+class HtmlRewriter(HTMLParser):
+    """Calls rewrite_attr(tag, name, value) for every attribute of every tag in the
+    document. If it returns a string, that replaces the attribute value,
+    otherwise the attribute is left as it is.
+
+    """
+    def __init__(self, rewrite_attr):
+        HTMLParser.__init__(self)
+        self.rewrite_attr = rewrite_attr
+        self.out = []
+
+    def rewrite(self, html):
+        """Rewrite the given html, returning the new document
+        """
+        self.out = []
+        self.feed(html)
+        self.close()
+        return "".join(self.out)
+
+    def _tag(self, tag, attrs, end):
+        changed = False
+        new_attrs = []
+        for name, value in attrs:
+            new_value = self.rewrite_attr(tag, name, value) if value is not None else None
+            if new_value is not None and new_value != value:
+                changed = True
+                value = new_value
+            new_attrs.append((name, value))
+
+        if not changed:
+            # Keep the tag exactly as it was in the document
+            self.out.append(self.get_starttag_text())
+            return
+
+        parts = [tag]
+        for name, value in new_attrs:
+            if value is None:
+                parts.append(name)
+            else:
+                parts.append('{0}="{1}"'.format(name, cgi.escape(value, quote=True)))
+        self.out.append("<{0}{1}>".format(" ".join(parts), " /" if end else ""))
+
+    def handle_starttag(self, tag, attrs):
+        self._tag(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._tag(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        self.out.append("</{0}>".format(tag))
+
+    def handle_data(self, data):
+        self.out.append(data)
+
+    def handle_entityref(self, name):
+        self.out.append("&{0};".format(name))
+
+    def handle_charref(self, name):
+        self.out.append("&#{0};".format(name))
+
+    def handle_comment(self, data):
+        self.out.append("<!--{0}-->".format(data))
+
+    def handle_decl(self, decl):
+        self.out.append("<!{0}>".format(decl))
+
+    def unknown_decl(self, data):
+        self.out.append("<![{0}]>".format(data))
+
+    def handle_pi(self, data):
+        self.out.append("<?{0}>".format(data))
+
+def find_attributes(html, tag, name):
+    """Get the values of all the name attributes of the given tag in the html, in
+    the order in which they appear.
+
+    """
+    values = []
+    def collect(attr_tag, attr_name, value):
+        if attr_tag == tag and attr_name == name:
+            values.append(value)
+
+    HtmlRewriter(collect).rewrite(html)
+    return values
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+# Shared HTTP client for the documentation scripts. All requests go through a
+# single requests session, so that connections to github and the dataset hosts
+# are kept alive and reused rather than doing a new TCP and TLS handshake for
+# every request.
+#
+# If a cache directory is given, GET responses which have an ETag or
+# Last-Modified header are stored on disk, and later requests for the same url
+# are made conditional. When the server replies with 304 Not Modified the stored
+# response is returned instead. Github does not count 304 responses against the
+# rate limit.
+#
+# Every request also goes through a scheduler which keeps track of the github
+# rate limit from the X-RateLimit headers. As the remaining quota runs low, fewer
+# requests are allowed to run at once, and once it runs out requests wait until
+# the quota is reset. Requests which fail because of rate limiting, server errors
+# or connection problems are retried with a jittered exponential backoff.
+
+import re
+import json
+import time
+import random
+import urllib
+import urlparse
+import threading
+from multiprocessing.pool import ThreadPool
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import disk_cache
+import instrumentation
+
+DEFAULT_POOL_SIZE = 10
+# The largest page size the github api allows
+PER_PAGE = 100
+
+LINK_RE = re.compile(r'<([^>]+)>;\s*rel="([^"]+)"')
+
+def parse_link_header(link):
+    """Parse a Link header into a dict from each rel to its url
+    """
+    return {rel: url for url, rel in LINK_RE.findall(link or "")}
+
+def set_query_params(url, **params):
+    """Set the given query parameters in the url, replacing any existing values
+    """
+    parts = urlparse.urlparse(url)
+    query = [(key, value) for key, value in urlparse.parse_qsl(parts.query) if key not in params]
+    query.extend(sorted(params.items()))
+    return urlparse.urlunparse(parts._replace(query=urllib.urlencode(query)))
+
+class HttpCache(object):
+    """Stores responses in a DiskCache, keyed by the url and the credentials used
+    to get them, since github returns different results for different users.
+
+    """
+    def __init__(self, cache_dir, max_bytes=disk_cache.DEFAULT_MAX_BYTES):
+        self.store = disk_cache.DiskCache(cache_dir, max_bytes)
+
+    def key(self, url, session):
+        return disk_cache.make_key(url, session.headers.get("Authorization", ""), repr(session.auth))
+
+    def get(self, key):
+        """Returns a (metadata, body) tuple for the cached response, or None
+        """
+        data = self.store.get(key)
+        if data is None:
+            return None
+        # The entry is a line of json metadata followed by the raw body
+        meta, body = data.split("\n", 1)
+        return json.loads(meta), body
+
+    def put(self, key, response):
+        if "ETag" not in response.headers and "Last-Modified" not in response.headers:
+            return # can't make a conditional request for this later
+        meta = {"url": response.url,
+                "encoding": response.encoding,
+                "headers": dict(response.headers)}
+        self.store.put(key, json.dumps(meta) + "\n" + response.content)
+
+    def conditional_headers(self, meta):
+        headers = {}
+        if "ETag" in meta["headers"]:
+            headers["If-None-Match"] = meta["headers"]["ETag"]
+        if "Last-Modified" in meta["headers"]:
+            headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        return headers
+
+    def to_response(self, meta, body):
+        """Reconstruct a requests response from a cache entry
+        """
+        response = requests.models.Response()
+        response.status_code = 200
+        response.url = meta["url"]
+        response.encoding = meta["encoding"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response._content = body
+        response.from_cache = True
+        return response
+
+class RateLimitScheduler(object):
+    """Limits the number of requests running at once, based on how much of the
+    rate limit quota remains. Up to max_concurrency requests run at once while
+    there is plenty of quota left, which drops to a single request at a time
+    when fewer than low_quota requests remain.
+
+    """
+    RETRY_STATUS = [429, 500, 502, 503, 504]
+
+    def __init__(self, max_concurrency=DEFAULT_POOL_SIZE, low_quota=100, max_retries=5, backoff=1.0, max_backoff=120.0):
+        self.max_concurrency = max_concurrency
+        self.low_quota = low_quota
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cond = threading.Condition()
+        self.active = 0
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+
+    def concurrency(self):
+        """The number of requests allowed to run at once with the current quota
+        """
+        if self.remaining is None:
+            return self.max_concurrency
+        if self.remaining <= self.low_quota:
+            return 1
+        # Scale down linearly once we get within a few multiples of the low quota
+        return max(1, min(self.max_concurrency, self.max_concurrency * self.remaining // (4 * self.low_quota)))
+
+    def acquire(self):
+        """Wait until a request is allowed to run
+        """
+        with self.cond:
+            while True:
+                now = time.time()
+                if self.remaining == 0 and self.reset and self.reset > now:
+                    print("Rate limit exhausted, waiting {0:.0f}s for it to reset".format(self.reset - now))
+                    self.cond.wait(self.reset - now + 1)
+                elif self.active >= self.concurrency():
+                    self.cond.wait()
+                else:
+                    self.active += 1
+                    return
+
+    def release(self, response=None):
+        with self.cond:
+            self.active -= 1
+            if response is not None:
+                self.update(response.headers)
+            self.cond.notify_all()
+
+    def update(self, headers):
+        """Update the quota from the rate limit headers of a response
+        """
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        self.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Limit" in headers:
+            self.limit = int(headers["X-RateLimit-Limit"])
+        if "X-RateLimit-Reset" in headers:
+            self.reset = int(headers["X-RateLimit-Reset"])
+        if self.reset and self.reset <= time.time():
+            self.remaining = None # the quota has been reset since
+
+    def should_retry(self, response):
+        if response.status_code in self.RETRY_STATUS:
+            return True
+        # github uses 403 for both forbidden and rate limited requests
+        return response.status_code == 403 and (response.headers.get("X-RateLimit-Remaining") == "0"
+                                                 or "Retry-After" in response.headers)
+
+    def retry_delay(self, response, attempt):
+        """How long to wait before retrying a request
+        """
+        if response is not None and "Retry-After" in response.headers:
+            return float(response.headers["Retry-After"])
+        if response is not None and response.headers.get("X-RateLimit-Remaining") == "0" and self.reset:
+            return max(0, self.reset - time.time()) + 1
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        # Jitter the delay so that concurrent requests don't all retry together
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def quota(self):
+        """The state of the rate limit quota as of the last response
+        """
+        with self.cond:
+            return {"limit": self.limit,
+                    "remaining": self.remaining,
+                    "reset": self.reset,
+                    "concurrency": self.concurrency(),
+                    "active": self.active}
+
+class Client(object):
+    """Wraps a requests session with connection pooling. Headers and auth given
+    here are attached to every request made through the client.
+
+    pool_size is the maximum number of connections kept open to a single host.
+    host_pool_sizes can be used to override this for specific hosts, e.g.
+    {"api.github.com": 20}.
+
+    If cache_dir is given, responses are cached there, up to cache_size bytes.
+
+    At most max_concurrency requests are made at once, fewer when the rate limit
+    is running low. Defaults to the pool size.
+
+    """
+    def __init__(self, headers=None, auth=None, pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None,
+                 cache_dir=None, cache_size=disk_cache.DEFAULT_MAX_BYTES, max_concurrency=None):
+        self.session = requests.Session()
+        # pool_connections is the number of hosts to keep pools for,
+        # pool_maxsize is the number of connections in each of those pools
+        adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if host_pool_sizes:
+            for host, size in host_pool_sizes.items():
+                host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+                self.session.mount("https://{}/".format(host), host_adapter)
+                self.session.mount("http://{}/".format(host), host_adapter)
+
+        if headers:
+            self.session.headers.update(headers)
+        if auth:
+            self.session.auth = auth
+
+        self.cache = HttpCache(cache_dir, cache_size) if cache_dir else None
+        self.scheduler = RateLimitScheduler(max_concurrency if max_concurrency else pool_size)
+
+    def get(self, url, **kwargs):
+        """Make a GET request, retrying if it fails because of rate limiting, server
+        errors or connection problems. If all retries fail, the last response is
+        returned, or the last exception raised.
+
+        """
+        attempt = 0
+        while True:
+            response = None
+            self.scheduler.acquire()
+            try:
+                response = self._get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                if attempt >= self.scheduler.max_retries:
+                    raise
+                print("Request to {0} failed: {1}".format(url, ex))
+            finally:
+                self.scheduler.release(response)
+
+            if response is not None and not self.scheduler.should_retry(response):
+                return response
+            if attempt >= self.scheduler.max_retries:
+                return response
+
+            delay = self.scheduler.retry_delay(response, attempt)
+            if response is not None:
+                print("Got {0} from {1}, retrying in {2:.1f}s".format(response.status_code, url, delay))
+            time.sleep(delay)
+            attempt += 1
+
+    def quota(self):
+        return self.scheduler.quota()
+
+    def _record(self, response, stream=False):
+        instrumentation.count("requests")
+        if stream:
+            # The body hasn't been read yet, so go by the header
+            instrumentation.count("bytes", int(response.headers.get("Content-Length", 0)))
+        else:
+            instrumentation.count("bytes", len(response.content))
+
+    def _get_page(self, url):
+        response = self.get(url)
+        response.raise_for_status()
+        return response.json()
+
+    def paginate(self, url, per_page=PER_PAGE, workers=None):
+        """Get all the items in a paginated github api listing, yielding them as
+        they arrive. The first page tells us how many pages there are, and the
+        rest are then fetched concurrently by up to workers requests at once,
+        but items are still yielded in order.
+
+        """
+        first = self.get(set_query_params(url, per_page=per_page))
+        first.raise_for_status()
+        for item in first.json():
+            yield item
+
+        links = parse_link_header(first.headers.get("link"))
+        if "last" not in links:
+            return # there is only one page
+
+        last_url = links["last"]
+        last_page = int(dict(urlparse.parse_qsl(urlparse.urlparse(last_url).query))["page"])
+        page_urls = [set_query_params(last_url, page=page) for page in range(2, last_page + 1)]
+        workers = workers if workers else self.scheduler.max_concurrency
+        pool = ThreadPool(max(1, min(workers, len(page_urls))))
+        try:
+            for page in pool.imap(self._get_page, page_urls):
+                for item in page:
+                    yield item
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _get(self, url, **kwargs):
+        kwargs = dict(kwargs)
+        # Streamed responses are not read into memory here, so can't be cached
+        if self.cache is None or kwargs.get("stream") or kwargs.get("params"):
+            response = self.session.get(url, **kwargs)
+            self._record(response, kwargs.get("stream"))
+            return response
+
+        key = self.cache.key(url, self.session)
+        cached = self.cache.get(key)
+        if cached:
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers.update(self.cache.conditional_headers(cached[0]))
+            kwargs["headers"] = headers
+
+        response = self.session.get(url, **kwargs)
+        self._record(response)
+        if response.status_code == 304 and cached:
+            instrumentation.count("http_cache_hits")
+            cached_response = self.cache.to_response(*cached)
+            # The rate limit headers saved with the entry are out of date, so
+            # replace them with the ones from the 304 for the scheduler
+            for name in list(cached_response.headers):
+                if name.lower().startswith("x-ratelimit-"):
+                    del cached_response.headers[name]
+            for name, value in response.headers.items():
+                if name.lower().startswith("x-ratelimit-"):
+                    cached_response.headers[name] = value
+            return cached_response
+        if response.status_code == 200:
+            self.cache.put(key, response)
+
+        return response
+
+_client = None
+_client_lock = threading.Lock()
+
+def configure(headers=None, auth=None, pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None,
+              cache_dir=None, cache_size=disk_cache.DEFAULT_MAX_BYTES, max_concurrency=None):
+    """Set up the shared client. Should be called once before any requests are
+    made, otherwise a client with no headers will be created on first use.
+
+    """
+    global _client
+    with _client_lock:
+        _client = Client(headers=headers, auth=auth, pool_size=pool_size, host_pool_sizes=host_pool_sizes,
+                         cache_dir=cache_dir, cache_size=cache_size, max_concurrency=max_concurrency)
+
+    return _client
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+
+    return _client
+
+def get(url, **kwargs):
+    """Make a GET request using the shared client
+    """
+    return get_client().get(url, **kwargs)
+
+def paginate(url, per_page=PER_PAGE, workers=None):
+    """Get all the items in a paginated listing using the shared client
+    """
+    return get_client().paginate(url, per_page, workers)
+
+def quota():
+    """The state of the github rate limit quota, as seen by the shared client
+    """
+    return get_client().quota()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# Records where the time goes during a scrape. Code is divided into named
+# phases, and the wall time and number of calls of each phase are recorded,
+# along with counters such as the number of requests made, bytes downloaded and
+# cache hits. Everything is recorded both overall and for the repository being
+# processed at the time, so that slow repositories can be found.
+#
+# The repository is tracked per thread. Work handed to a pool should be wrapped
+# with bind_repo so it is attributed to the repository that submitted it.
+
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start = time.time()
+        self.totals = self._new_stats()
+        self.repos = {}
+
+    def _new_stats(self):
+        return {"phases": {}, "counters": {}}
+
+    def current_repo(self):
+        return getattr(self.local, "repo", None)
+
+    @contextmanager
+    def repo(self, name):
+        """Attribute everything recorded in this thread in the block to the given
+        repository
+        """
+        previous = self.current_repo()
+        self.local.repo = name
+        try:
+            yield
+        finally:
+            self.local.repo = previous
+
+    def _targets(self):
+        """The stats which should be updated, i.e. the totals and the current repo
+        """
+        targets = [self.totals]
+        repo = self.current_repo()
+        if repo is not None:
+            if repo not in self.repos:
+                self.repos[repo] = self._new_stats()
+            targets.append(self.repos[repo])
+        return targets
+
+    def add_time(self, name, elapsed):
+        with self.lock:
+            for stats in self._targets():
+                phase = stats["phases"].setdefault(name, {"calls": 0, "wall_time": 0.0})
+                phase["calls"] += 1
+                phase["wall_time"] += elapsed
+
+    def count(self, name, value=1):
+        with self.lock:
+            for stats in self._targets():
+                stats["counters"][name] = stats["counters"].get(name, 0) + value
+
+    @contextmanager
+    def phase(self, name):
+        """Record the wall time of the block under the given phase name
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def report(self):
+        with self.lock:
+            return {"wall_time": time.time() - self.start,
+                    "totals": self.totals,
+                    "repos": self.repos}
+
+    def write_report(self, path, **extra):
+        report = self.report()
+        report.update(extra)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+recorder = Recorder()
+
+def phase(name):
+    return recorder.phase(name)
+
+def count(name, value=1):
+    recorder.count(name, value)
+
+def repo(name):
+    return recorder.repo(name)
+
+def timed(name):
+    """Decorator which records each call of the function under the given phase
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def bind_repo(func):
+    """Wrap func so that when it is called in another thread, what it records is
+    attributed to the repository of the thread which wrapped it
+    """
+    repo_name = recorder.current_repo()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with recorder.repo(repo_name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+# Reads occupancy grid maps saved in the ROS map_server format (a yaml file
+# describing a PGM image) and renders them as a pyramid of PNG tiles, for
+# showing maps in the docs and tutorials.
+#
+# The PGM raster is memory mapped rather than read into memory, and is
+# processed a band of rows at a time with numpy, so maps of hundreds of
+# megabytes can be handled without loading the whole image. Each level of the
+# pyramid is half the resolution of the one below it, and is kept in a
+# temporary memory mapped file while the tiles are cut from it.
+#
+# This should be run from the top level directory of strands_documentation.
+
+import os
+import sys
+import json
+import zlib
+import struct
+import argparse
+import tempfile
+import shutil
+import yaml
+import output_files
+
+try:
+    import numpy as np
+except ImportError:
+    print("Reading occupancy maps needs numpy. Install it with pip install numpy")
+    sys.exit(1)
+
+TILE_SIZE = 256
+
+# Occupancy values, as in a nav_msgs/OccupancyGrid
+FREE = 0
+OCCUPIED = 100
+UNKNOWN = -1
+
+# Colours the cells are drawn with, the same as map_saver uses
+FREE_COLOUR = 254
+OCCUPIED_COLOUR = 0
+UNKNOWN_COLOUR = 205
+
+def read_pgm_header(path):
+    """Read the header of a binary (P5) PGM file. Returns the width, height,
+    maximum value and the offset at which the pixel data starts.
+
+    """
+    with open(path, 'rb') as f:
+        # Headers are short, apart from any comments in them
+        header = f.read(4096)
+
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        if pos >= len(header):
+            raise ValueError("Couldn't parse the header of {0}".format(path))
+        if header[pos].isspace():
+            pos += 1
+        elif header[pos] == "#":
+            # Comments run to the end of the line
+            end = header.find("\n", pos)
+            pos = end + 1 if end >= 0 else len(header)
+        else:
+            start = pos
+            while pos < len(header) and not header[pos].isspace() and header[pos] != "#":
+                pos += 1
+            tokens.append(header[start:pos])
+
+    if tokens[0] != "P5":
+        raise ValueError("{0} is not a binary pgm file".format(path))
+    width, height, maxval = [int(token) for token in tokens[1:]]
+    # A single whitespace character separates the header from the data
+    return width, height, maxval, pos + 1
+
+class OccupancyMap(object):
+    """An occupancy grid map, described by the map_server yaml file at
+    yaml_path. The image is memory mapped, and occupancy values are computed
+    from it on demand with the thresholds in the yaml, using the same rules as
+    map_server.
+
+    """
+    def __init__(self, yaml_path):
+        with open(yaml_path, 'r') as f:
+            info = yaml.safe_load(f.read())
+
+        self.image_path = os.path.join(os.path.dirname(yaml_path), info["image"])
+        self.resolution = float(info["resolution"])
+        self.origin = [float(value) for value in info["origin"]]
+        self.negate = bool(int(info.get("negate", 0)))
+        self.occupied_thresh = float(info["occupied_thresh"])
+        self.free_thresh = float(info["free_thresh"])
+        self.mode = info.get("mode", "trinary")
+        # Raw maps store values which don't fit the occupancy range, so there is
+        # no sensible way to draw them
+        if self.mode not in ["trinary", "scale"]:
+            raise ValueError("Unknown map mode {0}".format(self.mode))
+
+        self.width, self.height, self.maxval, offset = read_pgm_header(self.image_path)
+        # 16 bit pgms are big endian
+        dtype = np.uint8 if self.maxval < 256 else np.dtype(">u2")
+        self.raster = np.memmap(self.image_path, dtype=dtype, mode='r', offset=offset, shape=(self.height, self.width))
+
+    def occupancy(self, start_row=0, end_row=None):
+        """Get the occupancy of the cells in the given rows of the image, as an
+        array of int8. Rows are in image order, so the first row is the top of
+        the map.
+
+        """
+        values = self.raster[start_row:end_row].astype(np.float32)
+        # How likely each cell is to be occupied. Dark pixels are occupied,
+        # unless the map is negated.
+        occ = values / self.maxval if self.negate else (self.maxval - values) / self.maxval
+
+        cells = np.empty(occ.shape, dtype=np.int8)
+        cells.fill(UNKNOWN)
+        occupied = occ > self.occupied_thresh
+        free = occ < self.free_thresh
+        cells[occupied] = OCCUPIED
+        cells[free] = FREE
+        if self.mode == "scale":
+            between = ~(occupied | free)
+            cells[between] = (1 + 98 * (occ[between] - self.free_thresh) / (self.occupied_thresh - self.free_thresh)).astype(np.int8)
+        return cells
+
+def render(cells):
+    """Colour an array of occupancy values for display
+    """
+    image = (FREE_COLOUR - cells.astype(np.int32) * (FREE_COLOUR - OCCUPIED_COLOUR) // OCCUPIED).astype(np.uint8)
+    image[cells < 0] = UNKNOWN_COLOUR
+    return image
+
+def downsample(cells):
+    """Halve the resolution of an array of occupancy values. Each cell takes the
+    highest occupancy of the four it covers, so obstacles don't disappear at
+    lower resolutions, and is only unknown if all four are unknown.
+
+    """
+    height, width = cells.shape
+    padded = np.empty((height + height % 2, width + width % 2), dtype=np.int8)
+    padded.fill(UNKNOWN)
+    padded[:height, :width] = cells
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).max(axis=(1, 3))
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+def encode_png(image):
+    """Encode a 2d uint8 array as an 8 bit greyscale png
+    """
+    height, width = image.shape
+    # Each row starts with a filter type byte, 0 for no filtering
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = image
+    return "".join(["\x89PNG\r\n\x1a\n",
+                    png_chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+                    png_chunk("IDAT", zlib.compress(rows.tostring(), 9)),
+                    png_chunk("IEND", "")])
+
+def write_tiles(level, cells, start_row, output_dir, tile_size):
+    """Cut a band of rows of a pyramid level into tiles, saved as
+    output_dir/level/column/row.png. start_row must be a multiple of the tile
+    size. Tiles at the edges are padded with unknown cells.
+
+    """
+    image = render(cells)
+    tile_row = start_row // tile_size
+    for row in range(0, image.shape[0], tile_size):
+        for col in range(0, image.shape[1], tile_size):
+            tile = np.empty((tile_size, tile_size), dtype=np.uint8)
+            tile.fill(UNKNOWN_COLOUR)
+            part = image[row:row + tile_size, col:col + tile_size]
+            tile[:part.shape[0], :part.shape[1]] = part
+            path = os.path.join(output_dir, str(level), str(col // tile_size), "{0}.png".format(tile_row + row // tile_size))
+            output_files.write(path, encode_png(tile))
+
+def num_levels(width, height, tile_size):
+    """Number of levels needed for the lowest resolution level to fit in a single
+    tile
+    """
+    levels = 1
+    while max(width, height) > tile_size:
+        width, height = (width + 1) // 2, (height + 1) // 2
+        levels += 1
+    return levels
+
+def build_pyramid(occupancy_map, output_dir, tile_size=TILE_SIZE, band_tiles=4):
+    """Render the map as a pyramid of tiles in output_dir. Level 0 fits in a
+    single tile, and the highest level is at the full resolution of the map.
+    The map is processed band_tiles rows of tiles at a time. Also writes
+    output_dir/tiles.json describing the pyramid.
+
+    """
+    width, height = occupancy_map.width, occupancy_map.height
+    levels = num_levels(width, height, tile_size)
+    band_rows = tile_size * band_tiles
+    work_dir = tempfile.mkdtemp(prefix="occupancy_map_")
+    try:
+        read_band = occupancy_map.occupancy
+        for level in reversed(range(levels)):
+            print("Writing level {0} of the pyramid, {1}x{2} cells".format(level, width, height))
+            next_cells = None
+            if level > 0:
+                next_cells = np.memmap(os.path.join(work_dir, "level_{0}".format(level - 1)), dtype=np.int8, mode='w+',
+                                       shape=((height + 1) // 2, (width + 1) // 2))
+            for start_row in range(0, height, band_rows):
+                cells = read_band(start_row, start_row + band_rows)
+                write_tiles(level, cells, start_row, output_dir, tile_size)
+                if next_cells is not None:
+                    # band_rows is even, so the bands line up with the next level
+                    next_cells[start_row // 2:start_row // 2 + (cells.shape[0] + 1) // 2] = downsample(cells)
+
+            if next_cells is not None:
+                next_cells.flush()
+                read_band = lambda start, end, cells=next_cells: np.asarray(cells[start:end])
+                height, width = next_cells.shape
+    finally:
+        shutil.rmtree(work_dir)
+
+    info = {"width": occupancy_map.width,
+            "height": occupancy_map.height,
+            "resolution": occupancy_map.resolution,
+            "origin": occupancy_map.origin,
+            "tile_size": tile_size,
+            # Resolution in metres per cell of each level, from level 0
+            "levels": [occupancy_map.resolution * 2 ** (levels - 1 - level) for level in range(levels)]}
+    output_files.write(os.path.join(output_dir, "tiles.json"), json.dumps(info, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render an occupancy grid map saved by map_server as a pyramid of png tiles, for use in the docs. This script should be run from the top level directory of strands_documentation.")
+    parser.add_argument("map", help="The map_server yaml file describing the map, e.g. resources/basic_map.yaml")
+    parser.add_argument("--output", help="Directory to write the tiles to. Default is docs/images/maps/<name of the map>.")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="Width and height of the tiles in pixels. Must be even. Default is {}.".format(TILE_SIZE))
+    parser.add_argument("--changes", default="docs/_changed_outputs.json", help="File in which to record the files which were changed, for build_docs.py. Default is docs/_changed_outputs.json.")
+    args = parser.parse_args()
+
+    if args.tile_size % 2:
+        parser.error("--tile-size must be even")
+
+    output_dir = args.output or os.path.join("docs", "images", "maps", os.path.splitext(os.path.basename(args.map))[0])
+    occupancy_map = OccupancyMap(args.map)
+    print("{0}: {1}x{2} cells at {3}m per cell".format(args.map, occupancy_map.width, occupancy_map.height, occupancy_map.resolution))
+    build_pyramid(occupancy_map, output_dir, args.tile_size)
+    output_files.writer.save_changes(args.changes)
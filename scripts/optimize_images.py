@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+# Makes the images in the docs smaller, to be run after a scrape. PNGs are
+# recompressed losslessly, and JPGs which are larger than they need to be are
+# re-encoded. Images wider than the docs can display get a downscaled variant,
+# and the rst pages which use them are changed to show the variant.
+#
+# The results are cached by a hash of the original image and the settings used,
+# so an image which was already processed is never processed again. Files are
+# only written if they change, and the changes are added to the changes file
+# used by build_docs.py.
+#
+# This should be run from the top level directory of strands_documentation.
+
+import os
+import re
+import sys
+import hashlib
+import argparse
+import disk_cache
+import output_files
+from StringIO import StringIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    print("Optimising images needs Pillow 6 or newer. Install it with pip install Pillow")
+    sys.exit(1)
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+
+# Changing any of these changes the cache keys, so images are processed again.
+# The version is increased whenever the way images are processed changes.
+CACHE_VERSION = "2"
+JPEG_QUALITY = 85
+VARIANT_SUFFIX = "{0}w"
+
+# Variants are named like image.960w.png, and are not processed themselves
+VARIANT_RE = re.compile(r"\.\d+w$")
+
+# An image or figure directive, possibly in a substitution definition, e.g.
+# .. |image0| image:: images/object-modeling-01.png
+DIRECTIVE_RE = re.compile(r"^(?P<indent>\s*)\.\. (?:\|[^|]+\| )?(?:image|figure):: (?P<uri>\S+)\s*$")
+
+# The EXIF tag giving the orientation the image should be shown in
+ORIENTATION_TAG = 0x0112
+
+def display_size(image):
+    """Size of the image as it is shown, after any rotation given by its EXIF
+    orientation
+    """
+    width, height = image.size
+    exif = image._getexif() if hasattr(image, "_getexif") else None
+    # Orientations 5 to 8 turn the image on its side
+    if exif and exif.get(ORIENTATION_TAG) in [5, 6, 7, 8]:
+        return height, width
+    return width, height
+
+def save_image(image, fmt, **params):
+    out = StringIO()
+    image.save(out, fmt, **params)
+    return out.getvalue()
+
+class ImageOptimizer(object):
+    """Optimises images, caching the results in cache_dir if it is given.
+    Images wider than max_width get a variant which is max_width wide. JPGs
+    larger than jpeg_max_bytes are re-encoded.
+
+    """
+    def __init__(self, max_width, jpeg_max_bytes, cache_dir=None, cache_size=disk_cache.DEFAULT_MAX_BYTES):
+        self.max_width = max_width
+        self.jpeg_max_bytes = jpeg_max_bytes
+        self.cache = disk_cache.DiskCache(cache_dir, cache_size) if cache_dir else None
+        self.saved_bytes = 0
+
+    def _cached(self, kind, data, process):
+        """Get the result of process(data) from the cache, or run it and cache
+        the result. If process leaves the data as it is, only an empty entry is
+        stored rather than a second copy of the data.
+        """
+        key = disk_cache.make_key(CACHE_VERSION, kind, hashlib.sha1(data).hexdigest(), str(self.max_width),
+                                  str(self.jpeg_max_bytes), str(JPEG_QUALITY))
+        if self.cache:
+            result = self.cache.get(key)
+            if result is not None:
+                return result or data
+
+        result = process(data)
+        if self.cache:
+            self.cache.put(key, "" if result == data else result)
+        return result
+
+    def _params(self, image, fmt):
+        if fmt == "PNG":
+            params = {"optimize": True}
+            keep = ["transparency", "dpi", "icc_profile"]
+        else:
+            params = {"quality": JPEG_QUALITY, "optimize": True, "progressive": True}
+            keep = ["exif", "icc_profile", "dpi"]
+        # Keep anything which would change how the image looks, like the
+        # orientation in the EXIF data and the colour profile, which Pillow
+        # doesn't carry over by itself
+        for name in keep:
+            if name in image.info:
+                params[name] = image.info[name]
+        return params
+
+    def _optimize(self, data):
+        image = Image.open(StringIO(data))
+        fmt = image.format
+        if fmt == "JPEG" and len(data) <= self.jpeg_max_bytes:
+            return data
+        if fmt not in ["PNG", "JPEG"]:
+            return data
+
+        optimized = save_image(image, fmt, **self._params(image, fmt))
+        # Recompressing an image which was already well compressed can make it
+        # bigger, in which case keep the original
+        return optimized if len(optimized) < len(data) else data
+
+    def _variant(self, data):
+        original = Image.open(StringIO(data))
+        fmt = original.format
+        # Rotate the image the way it is shown, which also removes the
+        # orientation from the EXIF data, so the variant is max_width wide as
+        # it is shown
+        image = ImageOps.exif_transpose(original)
+        height = int(round(image.size[1] * float(self.max_width) / image.size[0]))
+        resized = image.resize((self.max_width, max(1, height)), Image.LANCZOS)
+        return save_image(resized, fmt, **self._params(resized, fmt))
+
+    def optimize(self, path):
+        """Optimise the image at path in place. Returns the path of the variant
+        which should be displayed instead of the image, or None if the image is
+        small enough to display as it is.
+
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        optimized = self._cached("optimize", data, self._optimize)
+        # Also remember that the optimised image doesn't need optimising again
+        self._cached("optimize", optimized, lambda data: data)
+        if output_files.write(path, optimized):
+            self.saved_bytes += len(data) - len(optimized)
+            print("Optimised {0}: {1}KB -> {2}KB".format(path, len(data) // 1024, len(optimized) // 1024))
+
+        if display_size(Image.open(StringIO(optimized)))[0] <= self.max_width:
+            return None
+
+        name, ext = os.path.splitext(path)
+        variant_path = "{0}.{1}{2}".format(name, VARIANT_SUFFIX.format(self.max_width), ext)
+        if output_files.write(variant_path, self._cached("variant", optimized, self._variant)):
+            print("Wrote {0}".format(variant_path))
+        return variant_path
+
+def find_images(dirs):
+    """Find all the images in the given directories, apart from variants and
+    anything in a build directory
+    """
+    images = []
+    for top_dir in dirs:
+        for subdir, subdirs, files in os.walk(top_dir):
+            subdirs[:] = [d for d in subdirs if not d.startswith("_") and not d.startswith(".")]
+            for image_file in files:
+                name, ext = os.path.splitext(image_file)
+                if ext.lower() in IMAGE_EXTENSIONS and not VARIANT_RE.search(name):
+                    images.append(os.path.join(subdir, image_file))
+    return sorted(images)
+
+def rewrite_references(rst_text, rst_path, variants):
+    """Change image and figure directives in the rst which show an image with a
+    variant to show the variant instead. variants maps the normalised path of
+    each image to its variant.
+
+    Sphinx only publishes images which are shown by a directive, so the pages
+    can't link to the full size image.
+
+    """
+    out = []
+    for line in rst_text.split("\n"):
+        match = DIRECTIVE_RE.match(line)
+        if not match or "://" in match.group("uri"):
+            out.append(line)
+            continue
+
+        uri = match.group("uri")
+        image_path = os.path.normpath(os.path.join(os.path.dirname(rst_path), uri))
+        if image_path not in variants:
+            out.append(line)
+            continue
+
+        # The variant is next to the original, so only the filename changes
+        variant_uri = os.path.join(os.path.dirname(uri), os.path.basename(variants[image_path]))
+        out.append(line[:match.start("uri")] + variant_uri + line[match.end("uri"):])
+
+    return "\n".join(out)
+
+def find_pages(docs_dir):
+    pages = []
+    for subdir, dirs, files in os.walk(docs_dir):
+        dirs[:] = [d for d in dirs if not d.startswith("_") and not d.startswith(".")]
+        pages.extend(os.path.join(subdir, page) for page in files if page.endswith(".rst"))
+    return sorted(pages)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Losslessly recompress PNGs and re-encode large JPGs in the docs, and create smaller variants of wide images, which the rst pages are changed to display. Needs Pillow. This script should be run from the top level directory of strands_documentation.")
+    parser.add_argument("dirs", nargs="*", default=["docs", "resources"], help="Directories containing images to optimise. Default is docs and resources.")
+    parser.add_argument("--max-width", type=int, default=1200, help="Images wider than this many pixels get a variant of this width which is displayed on the page instead. Default is 1200.")
+    parser.add_argument("--jpeg-max-size", type=int, default=200, help="JPGs larger than this many kilobytes are re-encoded. Default is 200.")
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.expanduser("~"), ".cache", "strands_documentation"), help="Directory in which to cache optimised images. Default is ~/.cache/strands_documentation.")
+    parser.add_argument("--cache-size", type=int, default=512, help="Maximum size of the image cache in megabytes.")
+    parser.add_argument("--no-cache", action="store_true", help="Don't cache optimised images.")
+    parser.add_argument("--changes", default="docs/_changed_outputs.json", help="File in which to record the files which were changed, for build_docs.py. Default is docs/_changed_outputs.json.")
+    args = parser.parse_args()
+
+    optimizer = ImageOptimizer(args.max_width, args.jpeg_max_size * 1024,
+                               cache_dir=None if args.no_cache else os.path.join(args.cache_dir, "images"),
+                               cache_size=args.cache_size * 1024 * 1024)
+
+    variants = {}
+    for image_path in find_images(args.dirs):
+        try:
+            variant = optimizer.optimize(image_path)
+        except IOError as ex:
+            print("Couldn't optimise {0}: {1}".format(image_path, ex))
+            continue
+        if variant:
+            variants[os.path.normpath(image_path)] = variant
+
+    # Only pages in the docs show images, other directories are just optimised
+    for page in find_pages("docs"):
+        with open(page, 'r') as f:
+            text = f.read()
+        if output_files.write(page, rewrite_references(text, page, variants)):
+            print("Updated image references in {0}".format(page))
+
+    output_files.writer.save_changes(args.changes)
+    print("Saved {0}KB".format(optimizer.saved_bytes // 1024))
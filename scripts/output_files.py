@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# Writes files into the docs directory only when their contents change. The
+# whole of a file is rendered in memory first, and compared against the file
+# already on disk. If they are the same the file is left alone, so its
+# modification time doesn't change and sphinx doesn't rebuild the page.
+# Otherwise the new contents are written to a temporary file next to it which is
+# then renamed over it, so a page is never left half written.
+#
+# Every file which is written or removed is recorded, and can be saved to a
+# changes file, so that the docs build can be limited to the pages which
+# changed. Changes from several runs accumulate in the file until it is cleared
+# by a build.
+
+import os
+import json
+import errno
+import hashlib
+import tempfile
+import threading
+import instrumentation
+
+# Temporary files are created readable only by the owner, so give the outputs
+# the permissions they would have had from open()
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def file_hash(path):
+    """sha1 of the contents of the file at path, or None if it doesn't exist
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+    except IOError as ex:
+        if ex.errno == errno.ENOENT:
+            return None
+        raise
+    return digest.hexdigest()
+
+def make_dirs(path):
+    """Make sure the directory path exists
+    """
+    if path and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+class OutputWriter(object):
+    """Writes and removes output files, recording which ones were changed
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.created = set()
+        self.removed = set()
+
+    def write(self, path, content):
+        """Write content to path, unless the file there already has exactly that
+        content. Returns True if the file was written.
+
+        """
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        exists = os.path.isfile(path)
+        if exists and os.path.getsize(path) == len(content)\
+           and file_hash(path) == hashlib.sha1(content).hexdigest():
+            instrumentation.count("outputs_unchanged")
+            return False
+
+        make_dirs(os.path.dirname(path))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+        instrumentation.count("outputs_written")
+        with self.lock:
+            self.changed.add(path)
+            if not exists:
+                self.created.add(path)
+            self.removed.discard(path)
+        return True
+
+    def copy(self, source, path):
+        """Copy the file at source to path, if it is different
+        """
+        with open(source, 'rb') as f:
+            return self.write(path, f.read())
+
+    def remove(self, path):
+        """Remove the output at path, if it exists. Returns True if it was removed.
+        """
+        if not os.path.isfile(path):
+            return False
+
+        os.remove(path)
+        instrumentation.count("outputs_removed")
+        with self.lock:
+            self.removed.add(path)
+            self.changed.discard(path)
+            self.created.discard(path)
+        return True
+
+    def save_changes(self, path):
+        """Add the files changed so far to those recorded in the changes file at
+        path
+        """
+        changes = load_changes(path)
+        with self.lock:
+            if not (self.changed or self.removed):
+                return
+            changes = {"changed": (changes["changed"] - self.removed) | self.changed,
+                       "created": (changes["created"] - self.removed) | self.created,
+                       "removed": (changes["removed"] - self.changed) | self.removed}
+        save_changes(path, changes)
+
+def load_changes(path):
+    """Load the changes file at path. Returns a dict with the sets of changed,
+    created and removed files, which are empty if there is no file.
+    """
+    changes = {"changed": set(), "created": set(), "removed": set()}
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            for key, paths in json.load(f).items():
+                changes[key] = set(paths)
+    return changes
+
+def save_changes(path, changes):
+    make_dirs(os.path.dirname(path))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({key: sorted(paths) for key, paths in changes.items()}, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+writer = OutputWriter()
+
+def write(path, content):
+    return writer.write(path, content)
+
+def copy(source, path):
+    return writer.copy(source, path)
+
+def remove(path):
+    return writer.remove(path)
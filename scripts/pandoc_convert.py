@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Document conversion with pandoc. Each conversion starts a new pandoc process,
+# and for the small files we convert, starting the process takes most of the
+# time. Rather than converting documents one after the other, the conversion
+# service runs a pool of conversions at once, one per core, so that process
+# startup for one document overlaps with the conversion of the others.
+#
+# Documents are not combined into a single pandoc invocation, since the rst
+# writer collects link references at the end of the document, and reference
+# names from different documents would collide, so there is no reliable way to
+# split the output back up.
+#
+# If a cache directory is given, converted documents are stored there, keyed by
+# a hash of the source text, the formats, the pandoc arguments and the pandoc
+# version, so a document which hasn't changed is never converted twice.
+
+import os
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import disk_cache
+import instrumentation
+
+os.environ.setdefault('PYPANDOC_PANDOC', '/usr/bin/pandoc')
+import pypandoc
+
+class ConversionService(object):
+    """Converts documents with pandoc using a pool of workers. Each worker only
+    waits on its pandoc process, so threads are used rather than processes.
+
+    If cache_dir is given, conversion results are cached there, up to
+    cache_size bytes.
+
+    """
+    def __init__(self, workers=None, cache_dir=None, cache_size=disk_cache.DEFAULT_MAX_BYTES):
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.pool = None
+        self.lock = threading.Lock()
+        # Conversions may also be called directly from several threads, e.g. by
+        # the stages of a pipeline, so limit how many pandoc processes run at once
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.cache = disk_cache.DiskCache(cache_dir, cache_size) if cache_dir else None
+        self._pandoc_version = None
+
+    @property
+    def pandoc_version(self):
+        if self._pandoc_version is None:
+            self._pandoc_version = pypandoc.get_pandoc_version()
+        return self._pandoc_version
+
+    def convert(self, text, to, fmt, extra_args=None):
+        """Convert a single document from fmt to the pandoc format to. Returns utf-8
+        encoded text.
+
+        """
+        extra_args = list(extra_args or [])
+        if self.cache:
+            key = disk_cache.make_key(text, fmt, to, "\0".join(extra_args), self.pandoc_version)
+            converted = self.cache.get(key)
+            if converted is not None:
+                instrumentation.count("pandoc_cache_hits")
+                return converted
+
+        with self.slots:
+            with instrumentation.phase("pandoc"):
+                converted = pypandoc.convert_text(text, to, format=fmt, extra_args=extra_args).encode('utf-8')
+        instrumentation.count("pandoc_conversions")
+        if self.cache:
+            self.cache.put(key, converted)
+
+        return converted
+
+    def map(self, func, items):
+        """Apply func to each of the items on the worker pool, returning a list of
+        the results. This is for jobs which do some work around a conversion,
+        which can then call convert themselves.
+
+        """
+        items = list(items)
+        if len(items) <= 1 or self.workers == 1:
+            return [func(item) for item in items]
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+
+        # Make sure the work is recorded against the repository which submitted it
+        return self.pool.map(instrumentation.bind_repo(func), items, chunksize=1)
+
+_service = None
+_service_lock = threading.Lock()
+
+def configure(workers=None, cache_dir=None, cache_size=disk_cache.DEFAULT_MAX_BYTES):
+    """Set up the shared conversion service with the given number of workers,
+    which defaults to the number of cores.
+
+    """
+    global _service
+    with _service_lock:
+        _service = ConversionService(workers, cache_dir, cache_size)
+
+    return _service
+
+def get_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ConversionService()
+
+    return _service
+
+def convert(text, to, fmt, extra_args=None):
+    return get_service().convert(text, to, fmt, extra_args)
+
+def map(func, items):
+    return get_service().map(func, items)
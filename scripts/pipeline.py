@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# A pipeline of stages connected by bounded queues. Each stage has its own pool
+# of worker threads, so different kinds of work overlap: while one document is
+# being downloaded, another can be converted by pandoc and a third written to
+# disk. Since the queues between stages are bounded, a fast stage blocks once it
+# gets too far ahead of a slow one, and only a few items are held in memory at a
+# time however many there are in total.
+
+import sys
+import Queue
+import threading
+import instrumentation
+
+DEFAULT_QUEUE_SIZE = 16
+
+# Passed down the pipeline after the last item
+_DONE = object()
+
+class Pipeline(object):
+    """Feeds the items from source through each stage in turn. A stage is a
+    function taking an item and returning the item to pass to the next stage,
+    or None to drop it. Items may come out of a stage in a different order than
+    they went in.
+
+    """
+    def __init__(self, source, queue_size=DEFAULT_QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self.stop = threading.Event()
+        self.error = None
+        # The source is iterated in another thread, so record what it does
+        # against the repository which built the pipeline too
+        self.repo_name = instrumentation.recorder.current_repo()
+
+    def stage(self, func, workers=1):
+        """Add a stage which runs func on the given number of worker threads
+        """
+        # Make sure the work is recorded against the repository which built the
+        # pipeline
+        self.stages.append((instrumentation.bind_repo(func), max(1, workers)))
+        return self
+
+    def _fail(self):
+        if self.error is None:
+            self.error = sys.exc_info()
+        self.stop.set()
+
+    def _put(self, queue, item):
+        # Time out regularly so that a failure elsewhere doesn't leave this
+        # blocked forever on a full queue
+        while not self.stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, queue):
+        while not self.stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        return _DONE
+
+    def _feed(self, out_queue):
+        try:
+            with instrumentation.repo(self.repo_name):
+                for item in self.source:
+                    if not self._put(out_queue, item):
+                        return
+            self._put(out_queue, _DONE)
+        except Exception:
+            self._fail()
+
+    def _work(self, func, in_queue, out_queue, running, lock):
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _DONE:
+                    # Pass it back for the other workers in this stage
+                    self._put(in_queue, _DONE)
+                    break
+                result = func(item)
+                if result is not None and not self._put(out_queue, result):
+                    break
+        except Exception:
+            self._fail()
+        finally:
+            with lock:
+                running[0] -= 1
+                last = running[0] == 0
+            # The last worker to finish tells the next stage there is no more
+            if last:
+                self._put(out_queue, _DONE)
+
+    def run(self):
+        """Run the pipeline until every item has gone through every stage. Returns
+        a list of what came out of the last stage. If any stage raises an
+        exception, the pipeline is stopped and the exception is raised here.
+
+        """
+        queues = [Queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(queues[0],))]
+        for i, (func, workers) in enumerate(self.stages):
+            running = [workers]
+            lock = threading.Lock()
+            for _ in range(workers):
+                threads.append(threading.Thread(target=self._work, args=(func, queues[i], queues[i + 1], running, lock)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        results = []
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _DONE:
+                    break
+                results.append(item)
+        except BaseException:
+            # e.g. interrupted, so stop the workers too
+            self.stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+        return results